@@ -0,0 +1,122 @@
+"""
+Measures how responsive /slack/events stays while a large delete_old_messages runs.
+
+Fills a scratch database with expired messages, starts deleting them, and fires requests
+at the ASGI app for as long as the delete takes. Latency percentiles are printed once done.
+
+Usage:
+    python benchmarks/bench_db_offload.py [--rows 500000] [--inline]
+
+--inline runs the delete as one big statement directly on the event loop, the way the
+database module used to, for comparison.
+"""
+
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "fake")
+os.environ.setdefault("SIGNING_SECRET", "fake")
+os.environ.setdefault("TZ", "US/Eastern")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import httpx
+
+import database
+import retention
+import server
+
+
+def populate(rows: int) -> None:
+    """Fills the database with messages that are all old enough to be deleted."""
+    database.create_tables()
+
+    for conn in database.get_connection(commit=True):
+        conn.execute("INSERT INTO channels (slack_channel_id) VALUES ('bench')")
+        conn.executemany(
+            """INSERT INTO messages (
+                    week, message, message_timestamp, posted_at, channel_id
+                )
+                VALUES ('2020-01-05 00:00:00+00:00', 'benchmark message', ?, ?, 1)""",
+            (
+                [f"{1577836800 + idx}.000100", 1577836800 + idx + 0.0001]
+                for idx in range(rows)
+            ),
+        )
+
+
+async def hammer(client: httpx.AsyncClient, done: asyncio.Event) -> list:
+    """Sends requests one after another until told to stop, recording their latency."""
+    latencies = []
+
+    while not done.is_set():
+        started = time.perf_counter()
+        await client.post(
+            "/slack/events",
+            content=b"command=%2Fadd_channel&team_domain=bench&",
+            headers={
+                "X-Slack-Request-Timestamp": str(int(time.time())),
+                "X-Slack-Signature": "v0=not_a_real_signature",
+            },
+        )
+        latencies.append(time.perf_counter() - started)
+
+        # A request can finish without ever suspending, so give the delete a turn
+        await asyncio.sleep(0)
+
+    return latencies
+
+
+async def main(rows: int, inline: bool) -> None:
+    """Runs the benchmark and prints the results."""
+    populate(rows)
+
+    transport = httpx.ASGITransport(app=server.API)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        done = asyncio.Event()
+        requests = asyncio.create_task(hammer(client, done))
+
+        # Let a few requests through before the delete starts
+        await asyncio.sleep(0.1)
+
+        started = time.perf_counter()
+        if inline:
+            retention.delete_old_rows_batch.__wrapped__(
+                "messages", datetime.datetime.now(datetime.timezone.utc), rows
+            )
+        else:
+            await retention.delete_old_messages()
+        elapsed = time.perf_counter() - started
+
+        done.set()
+        latencies = sorted(await requests)
+
+    print(
+        f"deleted {rows} rows in {elapsed:.2f}s ({'inline' if inline else 'offloaded'})"
+    )
+    print(f"requests served: {len(latencies)}")
+    print(f"p50 latency: {statistics.median(latencies) * 1000:.2f}ms")
+    print(f"p99 latency: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms")
+    print(f"max latency: {latencies[-1] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    # Every request fails the signature check on purpose, so skip logging it
+    logging.disable(logging.WARNING)
+
+    asyncio.run(main(args.rows, args.inline))
@@ -0,0 +1,135 @@
+"""
+Compares the throughput and latency of the app with the rate limiting middleware
+written as a plain ASGI middleware against the http middleware it replaced.
+
+Requests are sent one after another through httpx's ASGI transport to both
+/slack/events and /healthz, and the requests per second along with the median and
+p99 latencies are printed for each.
+
+Usage:
+    python benchmarks/bench_middleware.py [--requests 5000]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "fake")
+os.environ.setdefault("SIGNING_SECRET", "fake")
+os.environ.setdefault("TZ", "US/Eastern")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+import database
+import server
+
+
+async def legacy_rate_limit_check_api(req: Request, call_next):
+    """The rate limiting middleware as it was before, as an http middleware."""
+    if req.scope["path"] != "/slack/events":
+        return await call_next(req)
+
+    req_body = await req.body()
+    req.state.body = req_body
+
+    fields = server.read_slash_command_fields(req_body)
+
+    if fields.get("command") == "/check_api":
+        team_domain = fields.get("team_domain")
+
+        if await server.check_api_on_cooldown(team_domain):
+            return PlainTextResponse("This command is on a cooldown period.")
+
+        await server.update_check_api_cooldown(team_domain)
+
+    return await call_next(req)
+
+
+def build_app(legacy: bool) -> FastAPI:
+    """Builds an app with the server's routes and one of the two middlewares."""
+    app = FastAPI()
+    app.include_router(server.API.router)
+
+    if legacy:
+        app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_rate_limit_check_api)
+    else:
+        app.add_middleware(server.CheckApiRateLimitMiddleware)
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> dict:
+    """Sends requests to a path one after another, recording their latency."""
+    latencies = []
+    started = time.perf_counter()
+
+    for _ in range(requests):
+        request_started = time.perf_counter()
+
+        if path == "/slack/events":
+            await client.post(
+                path,
+                content=b"command=%2Fadd_channel&team_domain=bench&",
+                headers={
+                    "X-Slack-Request-Timestamp": str(int(time.time())),
+                    "X-Slack-Signature": "v0=not_a_real_signature",
+                },
+            )
+        else:
+            await client.get(path)
+
+        latencies.append(time.perf_counter() - request_started)
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+async def main(requests: int) -> None:
+    """Runs the benchmark and prints the results."""
+    database.create_tables()
+
+    for legacy in (True, False):
+        transport = httpx.ASGITransport(app=build_app(legacy))
+
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for path in ("/slack/events", "/healthz"):
+                # Warm up before measuring
+                await measure(client, path, min(requests, 100))
+                results = await measure(client, path, requests)
+
+                print(
+                    f"{'http' if legacy else 'asgi'} middleware {path}: "
+                    f"{results['requests_per_second']:.0f} req/s, "
+                    f"p50 {results['p50'] * 1000:.3f}ms, "
+                    f"p99 {results['p99'] * 1000:.3f}ms"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    # Every request to /slack/events fails the signature check on purpose
+    logging.disable(logging.WARNING)
+
+    asyncio.run(main(args.requests))
@@ -0,0 +1,65 @@
+"""
+Measures how many Slack request signatures can be checked per second, using a verifier
+keyed once up front against keying a new HMAC for every request the way auth.py used to.
+
+Usage:
+    python benchmarks/bench_signature.py [--checks 200000] [--body-size 1024]
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import sys
+import time
+
+os.environ.setdefault("BOT_TOKEN", "fake")
+os.environ.setdefault("SIGNING_SECRET", "bench_secret")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# pylint: disable=wrong-import-position
+import auth
+
+
+def legacy_is_valid(req_timestamp: str, req_body: bytes, signature: str) -> bool:
+    """Checks a signature the way auth.py used to."""
+    singing_secret_as_byte_key = os.getenv("SIGNING_SECRET", "").encode("UTF-8")
+    expected_hash = hmac.new(
+        singing_secret_as_byte_key,
+        f"v0:{req_timestamp}:".encode() + req_body,
+        hashlib.sha256,
+    )
+
+    return hmac.compare_digest(f"v0={expected_hash.hexdigest()}", signature)
+
+
+def measure(is_valid, checks: int, req_timestamp: str, req_body: bytes) -> float:
+    """Returns how many signature checks were done per second."""
+    signature = "v0=" + "0" * 64
+
+    started = time.perf_counter()
+    for _ in range(checks):
+        is_valid(req_timestamp, req_body, signature)
+
+    return checks / (time.perf_counter() - started)
+
+
+def main(checks: int, body_size: int) -> None:
+    """Runs the benchmark and prints the results."""
+    req_timestamp = str(int(time.time()))
+    req_body = b"x" * body_size
+    verifier = auth.get_request_verifier()
+
+    for name, is_valid in (("legacy", legacy_is_valid), ("keyed", verifier.is_valid)):
+        print(
+            f"{name}: {measure(is_valid, checks, req_timestamp, req_body):,.0f} checks/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--body-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    main(args.checks, args.body_size)
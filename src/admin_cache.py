@@ -0,0 +1,146 @@
+"""
+A bounded cache of whether Slack users are workspace admins.
+
+Admin-only commands have to be acknowledged within three seconds, so their admin check
+is served from memory whenever possible rather than calling users.info every time.
+Entries expire after a while in case a change to a user slips past the bot, and
+concurrent lookups for the same user share a single call to Slack. The cache can
+optionally be warmed up with every user in the workspace, and entries are replaced
+whenever Slack sends a user_change event.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from functools import partial
+
+# The most users whose admin status will be kept around
+ADMIN_CACHE_SIZE = int(os.environ.get("ADMIN_CACHE_SIZE", "1024"))
+
+# Seconds that a user's admin status is trusted for before it is looked up again
+ADMIN_CACHE_TTL = float(os.environ.get("ADMIN_CACHE_TTL", "3600"))
+
+# Whether every user's admin status should be loaded from users.list on startup
+ADMIN_CACHE_WARMUP = os.environ.get("ADMIN_CACHE_WARMUP", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+class AdminCache:
+    """Maps Slack user ids to whether they're an admin and when that expires"""
+
+    def __init__(self, max_size: int = ADMIN_CACHE_SIZE, ttl: float = ADMIN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Lookups that are waiting on Slack, keyed by user id
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _get_cached(self, user_id: str) -> bool | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is None:
+                return None
+
+            admin, expires_at = entry
+
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            self._stats["hits"] += 1
+
+            return admin
+
+    def _store(self, users: Iterable[tuple[str, bool]]) -> None:
+        expires_at = time.monotonic() + self.ttl
+
+        for user_id, admin in users:
+            self._entries[user_id] = (admin, expires_at)
+            self._entries.move_to_end(user_id)
+            self._in_flight.pop(user_id, None)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _finish_lookup(self, user_id: str, in_flight: asyncio.Future) -> None:
+        with self._lock:
+            # The user may have been updated or invalidated while Slack was answering,
+            # in which case this answer is already out of date
+            if self._in_flight.get(user_id) is not in_flight:
+                return
+
+            del self._in_flight[user_id]
+
+            if not in_flight.cancelled() and in_flight.exception() is None:
+                self._store([(user_id, in_flight.result())])
+
+    async def get(self, user_id: str, lookup: Callable[[str], Awaitable[bool]]) -> bool:
+        """
+        Returns whether a user is an admin, calling lookup if the answer isn't cached.
+        Only one lookup runs for a user at a time, and anyone else asking about that
+        user while it runs waits for its answer.
+        """
+        admin = self._get_cached(user_id)
+
+        if admin is not None:
+            return admin
+
+        in_flight = self._in_flight.get(user_id)
+
+        if in_flight is not None:
+            with self._lock:
+                self._stats["coalesced"] += 1
+
+            return await asyncio.shield(in_flight)
+
+        in_flight = asyncio.ensure_future(lookup(user_id))
+        in_flight.add_done_callback(partial(self._finish_lookup, user_id))
+
+        with self._lock:
+            self._stats["misses"] += 1
+            self._in_flight[user_id] = in_flight
+
+        return await asyncio.shield(in_flight)
+
+    def put(self, user_id: str, admin: bool) -> None:
+        """Caches a user's admin status, evicting the least recently used user if full"""
+        self.put_many([(user_id, admin)])
+
+    def put_many(self, users: Iterable[tuple[str, bool]]) -> None:
+        """Caches the admin status of several users at once"""
+        with self._lock:
+            self._store(users)
+
+    def invalidate(self, user_id: str) -> None:
+        """Forgets a user's admin status so that it is looked up again next time"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._in_flight.pop(user_id, None)
+
+    def clear(self) -> None:
+        """Forgets every user's admin status"""
+        with self._lock:
+            self._entries.clear()
+            self._in_flight.clear()
+
+    def stats(self) -> dict:
+        """Reports the cache's size along with its hit, miss, and eviction counts"""
+        with self._lock:
+            return {"size": len(self._entries), **self._stats}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+ADMIN_CACHE = AdminCache()
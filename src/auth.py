@@ -8,11 +8,13 @@ import hmac
 import logging
 import os
 import time
-from functools import wraps
+from functools import cache, wraps
 
 from fastapi import HTTPException
 
+from admin_cache import ADMIN_CACHE
 from config import SLACK_APP
+from rate_limiter import SLACK_RATE_LIMITER
 
 
 async def get_user_info(user_id: str):
@@ -21,17 +23,52 @@ async def get_user_info(user_id: str):
 
     See https://api.slack.com/methods/users.info
     """
-    return await SLACK_APP.client.users_info(user=user_id)
+    return await SLACK_RATE_LIMITER.call(
+        "users.info", SLACK_APP.client.users_info, user=user_id
+    )
+
+
+async def lookup_is_admin(user_id: str) -> bool:
+    """Asks Slack whether a user is a workspace admin"""
+    user_info = await get_user_info(user_id)
+
+    return user_info.get("user", {}).get("is_admin", False)
 
 
 async def is_admin(user_id: str) -> bool:
     """
-    Gets info for the Slack user executing the command and checks if
-    they're a workspace admin.
+    Checks if the Slack user executing the command is a workspace admin.
+
+    The answer is usually cached, and is only looked up from Slack when it isn't.
     """
-    user_info = await get_user_info(user_id)
+    return await ADMIN_CACHE.get(user_id, lookup_is_admin)
 
-    return user_info.get("user", {}).get("is_admin", False)
+
+async def warm_up_admin_cache() -> int:
+    """
+    Caches the admin status of every user in the workspace, a page at a time.
+    Returns how many users were cached.
+
+    See https://api.slack.com/methods/users.list
+    """
+    cursor = None
+    cached = 0
+
+    while True:
+        response = await SLACK_RATE_LIMITER.call(
+            "users.list", SLACK_APP.client.users_list, cursor=cursor, limit=200
+        )
+        members = response.get("members", [])
+
+        ADMIN_CACHE.put_many(
+            (member["id"], member.get("is_admin", False)) for member in members
+        )
+        cached += len(members)
+
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+
+        if not cursor:
+            return cached
 
 
 def admin_required(command):
@@ -52,6 +89,43 @@ def admin_required(command):
     return auth_wrapper
 
 
+class SlackRequestVerifier:
+    """
+    Checks the signatures Slack sends with its requests.
+
+    The signing secret is only keyed into an HMAC once. Every request gets a copy of
+    that keyed HMAC, and the pieces of the signed payload are fed into it one at a time
+    so the body is never copied into a new string.
+    """
+
+    def __init__(self, signing_secret: str):
+        self._keyed_hmac = hmac.new(
+            signing_secret.encode("UTF-8"), digestmod=hashlib.sha256
+        )
+
+    def expected_hash(self, req_timestamp: str, req_body: bytes) -> hmac.HMAC:
+        """Returns the HMAC of a request's timestamp and body"""
+        expected_hash = self._keyed_hmac.copy()
+        expected_hash.update(b"v0:")
+        expected_hash.update(req_timestamp.encode())
+        expected_hash.update(b":")
+        expected_hash.update(req_body)
+
+        return expected_hash
+
+    def is_valid(self, req_timestamp: str, req_body: bytes, signature: str) -> bool:
+        """Checks whether a request's signature matches the one Slack would have sent"""
+        return hmac.compare_digest(
+            f"v0={self.expected_hash(req_timestamp, req_body).hexdigest()}", signature
+        )
+
+
+@cache
+def get_request_verifier() -> SlackRequestVerifier:
+    """Returns a verifier for the signing secret, which is only read once"""
+    return SlackRequestVerifier(os.getenv("SIGNING_SECRET", ""))
+
+
 async def generate_expected_hash(req_timestamp: str, req_body: bytes) -> hmac.HMAC:
     """
     Creates an HMAC object by piecing together our signing secret and
@@ -64,13 +138,7 @@ async def generate_expected_hash(req_timestamp: str, req_body: bytes) -> hmac.HM
     This hash can be used to compare with the X-Slack-Signature of the request
     to determine if the request originated from Slack.
     """
-    singing_secret_as_byte_key = os.getenv("SIGNING_SECRET", "").encode("UTF-8")
-
-    return hmac.new(
-        singing_secret_as_byte_key,
-        f"v0:{req_timestamp}:".encode() + req_body,
-        hashlib.sha256,
-    )
+    return get_request_verifier().expected_hash(req_timestamp, req_body)
 
 
 def validate_slack_command_source(request_invocation):
@@ -95,15 +163,17 @@ def validate_slack_command_source(request_invocation):
                 status_code=400, detail="There was an issue with your request."
             )
 
-        expected_hash = await generate_expected_hash(
-            request.headers["X-Slack-Request-Timestamp"], await request.body()
-        )
-        expected_signature = f"v0={expected_hash.hexdigest()}"
+        # The rate limiting middleware will usually have read the body already
+        body = getattr(request.state, "body", None)
+        if body is None:
+            body = await request.body()
 
         # If signatures do not match then either there's a software bug or
         # the request wasn't signed by Slack.
-        if not hmac.compare_digest(
-            expected_signature, request.headers["X-Slack-Signature"]
+        if not get_request_verifier().is_valid(
+            request.headers["X-Slack-Request-Timestamp"],
+            body,
+            request.headers["X-Slack-Signature"],
         ):
             logging.warning(
                 "A request to invoke a Slack command failed the signature check."
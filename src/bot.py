@@ -3,19 +3,65 @@
 import asyncio
 import datetime
 import logging
-import os
 import sqlite3
-import traceback
-from collections import defaultdict
+from collections import Counter, defaultdict
 
-import aiohttp
 import pytz
 
 import database
+import retention
+from admin_cache import ADMIN_CACHE
 from auth import admin_required
-from config import SLACK_APP
+from config import (
+    CHECK_API_JITTER,
+    CHECK_API_SCHEDULE,
+    CHECK_API_TIMEOUT,
+    MAX_CONCURRENT_CHANNELS,
+    POST_DAYS_EARLY,
+    POST_WEEKS_AHEAD,
+    SLACK_APP,
+)
 from error import UnsafeMessageSpilloverError
-from message_builder import build_event_blocks, chunk_messages
+from events_api import fetch_events
+from http_client import HTTP_CLIENT
+from message_builder import (
+    WEEK_LENGTH,
+    EventTimeline,
+    chunk_messages,
+    digest_events,
+    render_events,
+)
+from rate_limiter import SLACK_RATE_LIMITER
+from render_cache import RENDER_CACHE
+from scheduler import SCHEDULER, parse_schedule
+from single_flight import SingleFlight
+
+
+async def load_channel_states() -> dict:
+    """
+    Takes a snapshot of the latest week posted in each Slack channel, along with how
+    many messages were posted for it, so that spillover checks don't need to query the
+    database for every message
+    """
+    return {
+        slack_channel_id: {
+            "week": datetime.datetime.strptime(state["week"], "%Y-%m-%d %H:%M:%S%z"),
+            "message_count": state["message_count"],
+        }
+        for slack_channel_id, state in (await database.get_channel_states()).items()
+    }
+
+
+def record_posted_message(
+    channel_states: dict, week: datetime.datetime, slack_channel_id: str
+):
+    """Keeps the channel state snapshot up to date after a message has been posted"""
+    state = channel_states.get(slack_channel_id)
+
+    if state is None or week.date() > state["week"].date():
+        channel_states[slack_channel_id] = {"week": week, "message_count": 1}
+    elif week.date() == state["week"].date():
+        state["message_count"] += 1
 
 
 async def is_unsafe_to_spillover(
@@ -23,6 +69,7 @@ async def is_unsafe_to_spillover(
     new_messages_length: int,
     week: datetime.datetime,
     slack_channel_id: str,
+    channel_states: dict,
 ) -> bool:
     """
     Determines if it is safe to update the messages that list out events for a week for a given
@@ -34,25 +81,25 @@ async def is_unsafe_to_spillover(
     been posted then we cannot add messages to the current week (as things stand).
     """
     if new_messages_length > existing_messages_length > 0:
-        latest_message_for_channel = await database.get_most_recent_message_for_channel(
-            slack_channel_id
-        )
-        latest_message_week = datetime.datetime.strptime(
-            latest_message_for_channel["week"], "%Y-%m-%d %H:%M:%S%z"
-        )
+        latest_state_for_channel = channel_states.get(slack_channel_id)
 
         # If the latest message is for a more recent week then it is unsafe
         # to add new messages. We cannot place new messages before older, existing
         # ones. Instead we'll log an error and skip updating messages for
         # this Slack channel.
-        return latest_message_week.date() > week.date()
+        return (
+            latest_state_for_channel is not None
+            and latest_state_for_channel["week"].date() > week.date()
+        )
 
     return False
 
 
 async def post_new_message(slack_channel_id: str, msg_blocks: list, msg_text: str):
     """Posts a message to Slack"""
-    return await SLACK_APP.client.chat_postMessage(
+    return await SLACK_RATE_LIMITER.call(
+        "chat.postMessage",
+        SLACK_APP.client.chat_postMessage,
         channel=slack_channel_id,
         blocks=msg_blocks,
         text=msg_text,
@@ -61,10 +108,150 @@ async def post_new_message(slack_channel_id: str, msg_blocks: list, msg_text: st
     )
 
 
-async def post_or_update_messages(week, messages):
-    """Posts or updates a message in a slack channel for a week"""
-    channels = await database.get_slack_channel_ids()
-    existing_messages = await database.get_messages(week)
+async def post_or_update_channel_messages(
+    week,
+    messages,
+    slack_channel_id: str,
+    channel_messages: list,
+    existing_messages_length: int,
+    batch: database.MessageBatch,
+    channel_states: dict,
+) -> dict:
+    """
+    Posts or updates the messages for a week in a single Slack channel.
+
+    Messages are sent strictly in order so that message 1 always lands before message 2.
+    Records of the messages are collected in the batch rather than written right away.
+    Returns a tally of how many messages were posted, updated, or left unchanged.
+    """
+    # pylint: disable=too-many-arguments
+    results = {"posted": 0, "updated": 0, "unchanged": 0}
+
+    for msg_idx, msg in enumerate(messages):
+        msg_text = msg["text"]
+        msg_blocks = msg["blocks"]
+        msg_event_uuids = msg.get("event_uuids")
+
+        # If new events now warrant additional messages being posted.
+        if msg_idx > len(channel_messages) - 1:
+            if await is_unsafe_to_spillover(
+                existing_messages_length,
+                len(messages),
+                week,
+                slack_channel_id,
+                channel_states,
+            ):
+                raise UnsafeMessageSpilloverError
+
+            print(
+                f"Posting an additional message for week {week.strftime('%B %-d')} "
+                f"in {slack_channel_id}"
+            )
+
+            slack_response = await post_new_message(
+                slack_channel_id, msg_blocks, msg_text
+            )
+            record_posted_message(channel_states, week, slack_channel_id)
+
+            await batch.create_message(
+                week,
+                msg_text,
+                slack_response["ts"],
+                slack_channel_id,
+                msg_idx,
+                msg_event_uuids,
+            )
+
+            results["posted"] += 1
+        elif msg_text == channel_messages[msg_idx]["message"]:
+            print(
+                f"Message {msg_idx + 1} for week of "
+                f"{week.strftime('%B %-d')} in {slack_channel_id} "
+                "hasn't changed, not updating"
+            )
+
+            # Messages posted before their events were recorded
+            # only need their records brought up to date
+            if msg_event_uuids != channel_messages[msg_idx]["event_uuids"]:
+                await batch.update_message(
+                    week,
+                    msg_text,
+                    channel_messages[msg_idx]["timestamp"],
+                    slack_channel_id,
+                    msg_event_uuids,
+                )
+
+            results["unchanged"] += 1
+        else:
+            if await is_unsafe_to_spillover(
+                existing_messages_length,
+                len(messages),
+                week,
+                slack_channel_id,
+                channel_states,
+            ):
+                raise UnsafeMessageSpilloverError
+
+            print(
+                f"Updating message {msg_idx + 1} for week {week.strftime('%B %-d')} "
+                f"in {slack_channel_id}"
+            )
+
+            timestamp = channel_messages[msg_idx]["timestamp"]
+            await SLACK_RATE_LIMITER.call(
+                "chat.update",
+                SLACK_APP.client.chat_update,
+                ts=timestamp,
+                channel=slack_channel_id,
+                blocks=msg_blocks,
+                text=msg_text,
+            )
+
+            await batch.update_message(
+                week, msg_text, timestamp, slack_channel_id, msg_event_uuids
+            )
+
+            results["updated"] += 1
+
+    return results
+
+
+async def post_or_update_messages(
+    week,
+    messages,
+    slack_channel_ids: list | None = None,
+    digest: str | None = None,
+    existing_messages: list | None = None,
+    channel_states: dict | None = None,
+) -> dict:
+    """
+    Posts or updates the messages for a week in every subscribed Slack channel,
+    or just the given channels.
+
+    Each channel is handled in its own task, with at most MAX_CONCURRENT_CHANNELS
+    channels being worked on at once, so that the total time taken follows the
+    slowest channel rather than the sum of all of them.
+
+    A failure in one channel does not stop the others. Returns a summary containing
+    the results for every channel that succeeded and the errors for those that didn't.
+
+    The records of every message posted or updated in a channel are written to the
+    database together as soon as that channel is done. If a digest of the week's events
+    is given then it is recorded for every channel that was brought fully up to date.
+
+    The records of the messages already sent for the week, and the snapshot of every
+    channel's latest week, are looked up unless given.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    channels = (
+        slack_channel_ids
+        if slack_channel_ids is not None
+        else await database.get_slack_channel_ids()
+    )
+    if existing_messages is None:
+        existing_messages = await database.get_messages(week)
+    if channel_states is None:
+        channel_states = await load_channel_states()
 
     # used to lookup the message id and message for a particular
     # channel
@@ -74,85 +261,45 @@ async def post_or_update_messages(week, messages):
             {
                 "timestamp": existing_message["message_timestamp"],
                 "message": existing_message["message"],
+                "event_uuids": existing_message["event_uuids"],
             }
         )
 
-    # used to quickly lookup if a message has been posted for a
-    # particular channel
-    posted_channels_set = set(message_details.keys())
-
-    for slack_channel_id in channels:
-        try:
-            for msg_idx, msg in enumerate(messages):
-                msg_text = msg["text"]
-                msg_blocks = msg["blocks"]
-
-                # If new events now warrant additional messages being posted.
-                if msg_idx > len(message_details[slack_channel_id]) - 1:
-                    if await is_unsafe_to_spillover(
-                        len(existing_messages), len(messages), week, slack_channel_id
-                    ):
-                        raise UnsafeMessageSpilloverError
-
-                    print(
-                        f"Posting an additional message for week {week.strftime('%B %-d')} "
-                        f"in {slack_channel_id}"
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHANNELS)
+
+    async with database.MessageBatch() as batch:
+
+        async def update_channel(slack_channel_id: str) -> dict:
+            try:
+                async with semaphore:
+                    results = await post_or_update_channel_messages(
+                        week,
+                        messages,
+                        slack_channel_id,
+                        message_details[slack_channel_id],
+                        len(existing_messages),
+                        batch,
+                        channel_states,
                     )
 
-                    slack_response = await post_new_message(
-                        slack_channel_id, msg_blocks, msg_text
-                    )
-
-                    await database.create_message(
-                        week, msg_text, slack_response["ts"], slack_channel_id, msg_idx
-                    )
-                elif (
-                    slack_channel_id in posted_channels_set
-                    and msg_text
-                    == message_details[slack_channel_id][msg_idx]["message"]
-                ):
-                    print(
-                        f"Message {msg_idx + 1} for week of "
-                        f"{week.strftime('%B %-d')} in {slack_channel_id} "
-                        "hasn't changed, not updating"
-                    )
-                elif slack_channel_id in posted_channels_set:
-                    if await is_unsafe_to_spillover(
-                        len(existing_messages), len(messages), week, slack_channel_id
-                    ):
-                        raise UnsafeMessageSpilloverError
-
-                    print(
-                        f"Updating message {msg_idx + 1} for week {week.strftime('%B %-d')} "
-                        f"in {slack_channel_id}"
-                    )
-
-                    timestamp = message_details[slack_channel_id][msg_idx]["timestamp"]
-                    slack_response = await SLACK_APP.client.chat_update(
-                        ts=timestamp,
-                        channel=slack_channel_id,
-                        blocks=msg_blocks,
-                        text=msg_text,
-                    )
+                if digest is not None:
+                    await batch.set_week_digest(week, slack_channel_id, digest)
+            finally:
+                # Record what reached Slack as soon as the channel is done with
+                # rather than risk losing it if the process dies before the rest finish
+                await batch.flush()
 
-                    await database.update_message(
-                        week, msg_text, timestamp, slack_channel_id
-                    )
+            return results
 
-                else:
-                    print(
-                        f"Posting message {msg_idx + 1} for week {week.strftime('%B %-d')} "
-                        f"in {slack_channel_id}"
-                    )
+        channel_results = await asyncio.gather(
+            *(update_channel(slack_channel_id) for slack_channel_id in channels),
+            return_exceptions=True,
+        )
 
-                    slack_response = await post_new_message(
-                        slack_channel_id, msg_blocks, msg_text
-                    )
+    summary = {"results": {}, "errors": {}}
 
-                    await database.create_message(
-                        week, msg_text, slack_response["ts"], slack_channel_id, msg_idx
-                    )
-        except UnsafeMessageSpilloverError:
+    for slack_channel_id, result in zip(channels, channel_results):
+        if isinstance(result, UnsafeMessageSpilloverError):
             # Log error and skip this Slack channel
             logging.error(
                 "Cannot update messages for %s for channel %s. "
@@ -164,71 +311,252 @@ async def post_or_update_messages(week, messages):
                 len(existing_messages),
                 len(messages),
             )
+            summary["errors"][slack_channel_id] = result
+        elif isinstance(result, Exception):
+            logging.error(
+                "Failed to post or update messages for %s for channel %s: %r",
+                week.strftime("%m/%d/%Y"),
+                slack_channel_id,
+                result,
+            )
+            summary["errors"][slack_channel_id] = result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            summary["results"][slack_channel_id] = result
 
-            continue
+    return summary
 
 
-async def parse_events_for_week(probe_date, resp):
-    """Parses events for the week containing the probe date"""
-    week_start = probe_date - datetime.timedelta(days=(probe_date.weekday() % 7) + 1)
-    week_end = week_start + datetime.timedelta(days=7)
+def get_message_layout(existing_messages: list) -> list | None:
+    """
+    Returns the uuids of the events in each of a week's messages, in order,
+    as they were last posted to most channels.
 
-    event_blocks = await build_event_blocks(resp, week_start, week_end)
+    Returns None if no channel has a complete record of its messages' events.
+    """
+    channel_layouts = defaultdict(list)
+    for existing_message in existing_messages:
+        channel_layouts[existing_message["slack_channel_id"]].append(
+            existing_message["event_uuids"]
+        )
 
-    chunked_messages = await chunk_messages(event_blocks, week_start)
+    layouts = Counter(
+        tuple(tuple(event_uuids) for event_uuids in layout)
+        for layout in channel_layouts.values()
+        if None not in layout
+    )
 
-    await post_or_update_messages(week_start, chunked_messages)
+    if not layouts:
+        return None
 
+    return [list(event_uuids) for event_uuids in layouts.most_common(1)[0][0]]
 
-async def check_api():
-    """Check the api for updates and update any existing messages"""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            os.environ.get("EVENTS_API_URL") or "https://events.openupstate.org/api/gtc"
-        ) as resp:
-            # get timezone aware today
-            today = datetime.date.today()
-            today = datetime.datetime(
-                today.year, today.month, today.day, tzinfo=pytz.utc
-            )
 
-            # keep current week's post up to date
-            await parse_events_for_week(today, resp)
+def get_week_start(probe_date: datetime.datetime) -> datetime.datetime:
+    """Returns the start of the week containing the probe date"""
+    return probe_date - datetime.timedelta(days=(probe_date.weekday() % 7) + 1)
 
-            # potentially post next week 5 days early
-            probe_date = today + datetime.timedelta(days=5)
-            await parse_events_for_week(probe_date, resp)
 
+# Counts how many times a week was skipped because its events hadn't changed
+# versus how many times it needed to be rebuilt
+WEEK_DIGEST_STATS = {"skipped": 0, "changed": 0}
 
-async def periodically_delete_old_messages():
-    """Once a day delete messages older than 90 days
-    This function runs in a thread, meaning that it needs to create it's own
-    database connection. This is OK however, since it only runs once a day
+
+def get_weeks_to_post(today: datetime.datetime) -> list:
     """
-    print("Deleting old messages once a day")
-    while True:
-        try:
-            await database.delete_old_messages()
-        except Exception:  # pylint: disable=broad-except
-            print(traceback.format_exc())
-            os._exit(1)
-        await asyncio.sleep(60 * 60 * 24)  # 24 hours
+    Returns the start of every week whose events are posted, in order: the current week,
+    the next week once it's close enough, and however many weeks past that are configured
+    """
+    last_week_start = get_week_start(
+        today + datetime.timedelta(days=POST_DAYS_EARLY, weeks=POST_WEEKS_AHEAD)
+    )
+    weeks = [get_week_start(today)]
 
+    while weeks[-1] < last_week_start:
+        weeks.append(weeks[-1] + WEEK_LENGTH)
 
-async def periodically_check_api():
-    """Periodically check the api every hour
+    return weeks
 
-    This function runs in a thread, meaning that it needs to create it's own
-    database connection. This is OK however, since it only runs once an hour
+
+async def parse_events_for_weeks(
+    weeks: list, timeline: EventTimeline, channel_states: dict | None = None
+) -> list:
     """
-    print("Checking api every hour")
-    while True:
-        try:
-            await check_api()
-        except Exception:  # pylint: disable=broad-except
-            print(traceback.format_exc())
-            os._exit(1)
-        await asyncio.sleep(60 * 60)  # 60 minutes x 60 seconds
+    Parses events for each of the weeks, in order, returning a summary for each
+
+    The timeline's events are bucketed into every week in a single pass, and the digests
+    and existing messages for all of the weeks are each loaded with a single query.
+    Channels whose messages for a week were built from the same events are left alone,
+    and if that's every channel then the week is skipped without building anything.
+
+    A snapshot of every channel's latest week can be given to share it between runs.
+    """
+    # pylint: disable=too-many-locals
+    week_events = timeline.by_week(weeks)
+    week_digests = await database.get_weeks_digests(weeks)
+    slack_channel_ids = await database.get_slack_channel_ids()
+
+    # the digest of each week that needs rebuilding, and the channels it's stale in
+    stale_weeks = {}
+
+    for week_start in weeks:
+        digest = await digest_events(week_events[week_start], week_start)
+        stale_channels = [
+            slack_channel_id
+            for slack_channel_id in slack_channel_ids
+            if week_digests[str(week_start)].get(slack_channel_id) != digest
+        ]
+
+        if stale_channels:
+            stale_weeks[week_start] = (digest, stale_channels)
+        else:
+            WEEK_DIGEST_STATS["skipped"] += 1
+            print(
+                f"Events for week of {week_start.strftime('%B %-d')} "
+                "haven't changed, not updating"
+            )
+
+    if not stale_weeks:
+        return [{"results": {}, "errors": {}} for _ in weeks]
+
+    weeks_messages = await database.get_weeks_messages(list(stale_weeks))
+
+    if channel_states is None:
+        channel_states = await load_channel_states()
+
+    summaries = []
+
+    for week_start in weeks:
+        if week_start not in stale_weeks:
+            summaries.append({"results": {}, "errors": {}})
+            continue
+
+        WEEK_DIGEST_STATS["changed"] += 1
+
+        digest, stale_channels = stale_weeks[week_start]
+        existing_messages = weeks_messages[str(week_start)]
+        event_blocks = [
+            rendered async for rendered in render_events(week_events[week_start])
+        ]
+
+        # keep events in the messages they were posted in so fewer messages change,
+        # but pack the week afresh for channels that don't have any messages yet
+        posted_channels = {msg["slack_channel_id"] for msg in existing_messages}
+        layout = get_message_layout(existing_messages)
+        summary = {"results": {}, "errors": {}}
+
+        for channels, channel_layout in (
+            ([c for c in stale_channels if c in posted_channels], layout),
+            ([c for c in stale_channels if c not in posted_channels], None),
+        ):
+            if not channels:
+                continue
+
+            channels_summary = await post_or_update_messages(
+                week_start,
+                await chunk_messages(event_blocks, week_start, channel_layout),
+                channels,
+                digest,
+                existing_messages,
+                channel_states,
+            )
+            summary["results"].update(channels_summary["results"])
+            summary["errors"].update(channels_summary["errors"])
+
+        summaries.append(summary)
+
+    return summaries
+
+
+# Describes the last check_api run that updated every channel without any errors
+LAST_CLEAN_RUN = {"key": None}
+
+
+async def check_api(force: bool = False):
+    """
+    Check the api for updates and update any existing messages
+
+    Nothing is rebuilt if the events feed, the weeks being posted, and the subscribed
+    channels are all the same as they were for the last run that went off without any
+    errors. Pass force=True to rebuild regardless.
+    """
+    feed = await fetch_events(HTTP_CLIENT.session())
+
+    print(f"HTTP connections: {HTTP_CLIENT.stats()}")
+
+    # get timezone aware today
+    today = datetime.date.today()
+    today = datetime.datetime(today.year, today.month, today.day, tzinfo=pytz.utc)
+
+    # the current week, the next week once it's close, and any configured weeks after
+    weeks = get_weeks_to_post(today)
+
+    run_key = (
+        feed.digest,
+        tuple(weeks),
+        tuple(sorted(await database.get_slack_channel_ids())),
+    )
+
+    if not force and run_key == LAST_CLEAN_RUN["key"]:
+        print("Events haven't changed since the last check, not updating")
+        return
+
+    # the feed is decoded just once, keeping only the events for the weeks being posted
+    timeline = await EventTimeline.from_response(
+        feed, weeks[0], weeks[-1] + WEEK_LENGTH
+    )
+
+    await RENDER_CACHE.load()
+
+    # one snapshot of the channels is kept up to date across every week
+    channel_states = await load_channel_states()
+
+    summaries = await parse_events_for_weeks(weeks, timeline, channel_states)
+
+    await RENDER_CACHE.save()
+
+    print(f"Render cache: {RENDER_CACHE.stats()}")
+    print(f"Slack rate limits: {SLACK_RATE_LIMITER.stats()}")
+    print(f"Weeks skipped vs. rebuilt: {WEEK_DIGEST_STATS}")
+
+    LAST_CLEAN_RUN["key"] = (
+        run_key if not any(summary["errors"] for summary in summaries) else None
+    )
+
+
+# Runs of check_api are coordinated so that the hourly check and any number of
+# /check_api commands never post at the same time. The timeout is applied to the
+# runs themselves, since giving up on waiting for a run doesn't cancel it.
+CHECK_API_RUNS = SingleFlight(check_api, timeout=CHECK_API_TIMEOUT)
+
+
+async def delete_old_messages():
+    """Delete messages that are older than their retention period"""
+    retention_stats = await retention.delete_old_messages()
+    print(f"Deleted old rows: {retention_stats}")
+
+
+async def scheduled_check_api():
+    """Check the api for updates on the regular schedule"""
+    await CHECK_API_RUNS.run()
+
+
+SCHEDULER.add_job(
+    "check_api",
+    scheduled_check_api,
+    schedule=parse_schedule(CHECK_API_SCHEDULE),
+    jitter=CHECK_API_JITTER,
+)
+# Stopping the check_api job only stops it waiting, so the run is cancelled as well
+SCHEDULER.on_stop(CHECK_API_RUNS.cancel)
+SCHEDULER.add_job(
+    "delete_old_messages",
+    delete_old_messages,
+    schedule=parse_schedule(retention.DB_RETENTION_SCHEDULE),
+    jitter=retention.DB_RETENTION_JITTER,
+    timeout=retention.DB_RETENTION_TIMEOUT,
+)
 
 
 @SLACK_APP.command("/add_channel")
@@ -266,4 +594,15 @@ async def trigger_check_api(ack, say, logger, command):
     logger.info(f"{command['command']} from {command['channel_id']}")
     if command["channel_id"] is not None:
         await ack("Checking api for events 👍")
-        await check_api()
+        await CHECK_API_RUNS.run(force=True)
+
+
+@SLACK_APP.event("user_change")
+async def handle_user_change(event, logger):
+    """Keep cached admin statuses up to date whenever a user changes"""
+    user = event.get("user", {})
+    logger.info(f"user_change for {user.get('id')}")
+    if "is_admin" in user:
+        ADMIN_CACHE.put(user["id"], user["is_admin"])
+    elif "id" in user:
+        ADMIN_CACHE.invalidate(user["id"])
@@ -3,15 +3,57 @@ Location for configuration settings and app-wide constants.
 """
 
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from slack_bolt.adapter.fastapi.async_handler import AsyncSlackRequestHandler
 from slack_bolt.async_app import AsyncApp
 
-API = FastAPI()
+import database
+from http_client import HTTP_CLIENT, HTTP_TOTAL_TIMEOUT, SharedSessionWebClient
+from scheduler import SCHEDULER
 
-# configure Slack app
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """
+    Runs the bot's periodic jobs alongside the server, and closes the HTTP session
+    and database connections they share with it once the server shuts down
+    """
+    await SCHEDULER.start()
+    yield
+    await SCHEDULER.stop()
+    await HTTP_CLIENT.close()
+    database.close_pool()
+
+
+API = FastAPI(lifespan=lifespan)
+
+# configure Slack app, sharing the HTTP session with the rest of the bot
 SLACK_APP = AsyncApp(
-    token=os.environ.get("BOT_TOKEN"), signing_secret=os.environ.get("SIGNING_SECRET")
+    client=SharedSessionWebClient(
+        # Bolt would fall back to SLACK_BOT_TOKEN itself if it made its own client
+        token=os.environ.get("BOT_TOKEN") or os.environ.get("SLACK_BOT_TOKEN"),
+        timeout=int(HTTP_TOTAL_TIMEOUT),
+    ),
+    signing_secret=os.environ.get("SIGNING_SECRET"),
 )
 SLACK_APP_HANDLER = AsyncSlackRequestHandler(SLACK_APP)
+
+# The number of Slack channels that may have their messages posted or updated at once
+MAX_CONCURRENT_CHANNELS = int(os.environ.get("MAX_CONCURRENT_CHANNELS", "10"))
+
+# Days ahead of time that the next week's events start being posted
+POST_DAYS_EARLY = int(os.environ.get("POST_DAYS_EARLY", "5"))
+
+# How many more weeks past that to post events for
+POST_WEEKS_AHEAD = int(os.environ.get("POST_WEEKS_AHEAD", "0"))
+
+# When the events API is checked for updates, as a number of seconds or a cron expression
+CHECK_API_SCHEDULE = os.environ.get("CHECK_API_SCHEDULE", str(60 * 60))
+
+# Up to how many seconds each scheduled check of the events API is randomly delayed by
+CHECK_API_JITTER = float(os.environ.get("CHECK_API_JITTER", "60"))
+
+# Seconds that a check of the events API may take before it is cancelled and fails
+CHECK_API_TIMEOUT = float(os.environ.get("CHECK_API_TIMEOUT", "900"))
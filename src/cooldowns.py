@@ -0,0 +1,109 @@
+"""
+Keeps track of cooldowns in memory so that checking one never has to touch the disk.
+
+Cooldowns are loaded from the database the first time they're needed, and any new
+ones are written back to it in the background so that they survive restarts.
+Deadlines are kept on the monotonic clock, so they aren't thrown off if the system
+clock changes while the bot is running.
+"""
+
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+
+
+class CooldownStore:
+    """Maps accessors and the resources they've used to when they may use them again"""
+
+    def __init__(self):
+        self._deadlines = {}
+        self._pending_writes = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    async def load(self) -> None:
+        """Fills the store with the cooldowns that haven't expired in the database"""
+        rows = await database.get_active_cooldowns()
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        monotonic_now = time.monotonic()
+
+        with self._lock:
+            for accessor, resource, expires_at in rows:
+                deadline = monotonic_now + (
+                    (datetime.datetime.fromisoformat(expires_at) - now).total_seconds()
+                )
+
+                # Cooldowns started while loading are newer than the ones in the database
+                self._deadlines[(accessor, resource)] = max(
+                    deadline, self._deadlines.get((accessor, resource), deadline)
+                )
+
+            self._loaded = True
+
+    async def is_on_cooldown(self, accessor: str, resource: str) -> bool:
+        """Checks whether an accessor has to wait before using a resource again"""
+        if not self._loaded:
+            await self.load()
+
+        with self._lock:
+            deadline = self._deadlines.get((accessor, resource))
+
+            if deadline is None:
+                return False
+
+            if time.monotonic() >= deadline:
+                del self._deadlines[(accessor, resource)]
+                return False
+
+            return True
+
+    def _finish_write(self, write: Future):
+        with self._lock:
+            self._pending_writes.discard(write)
+
+        if write.exception() is not None:
+            logging.error(
+                "Failed to save a cooldown to the database: %r", write.exception()
+            )
+
+    def start_cooldown(self, accessor: str, resource: str, cooldown_minutes: int):
+        """
+        Puts a resource on cooldown for an accessor,
+        and queues up writing the cooldown to the database.
+        """
+        with self._lock:
+            self._deadlines[(accessor, resource)] = (
+                time.monotonic() + cooldown_minutes * 60
+            )
+
+        write = database.create_cooldown.submit(accessor, resource, cooldown_minutes)
+
+        with self._lock:
+            self._pending_writes.add(write)
+
+        write.add_done_callback(self._finish_write)
+
+    def flush(self) -> None:
+        """Waits for every queued write to the database to finish"""
+        with self._lock:
+            pending_writes = list(self._pending_writes)
+
+        for write in pending_writes:
+            write.exception()
+
+    def clear(self) -> None:
+        """Forgets every cooldown, so they'll be loaded from the database again"""
+        with self._lock:
+            self._deadlines.clear()
+            self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+
+COOLDOWNS = CooldownStore()
@@ -1,135 +1,674 @@
 """Contains all the functions that interact with the sqlite database"""
 
+import asyncio
 import datetime
+import functools
+import json
+import logging
 import os
+import queue
 import sqlite3
-from typing import Generator, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator
 
 DB_PATH = os.path.abspath(os.environ.get("DB_PATH", "./slack-events-bot.db"))
 
+# The most idle connections that will be kept open for reuse
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+# Seconds a connection will wait on another connection's lock before giving up
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "5"))
+# The number of prepared statements each connection keeps cached
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "128"))
+
+# Pragmas applied to every connection. See https://www.sqlite.org/pragma.html
+DB_PRAGMAS = {
+    # DELETE keeps everything in the database file, which is all that docker-compose.yml
+    # mounts. WAL lets readers carry on while a write is in progress, but keeps recent
+    # writes in -wal and -shm files next to the database that must be kept as well.
+    "journal_mode": os.environ.get("DB_JOURNAL_MODE", "DELETE"),
+    # NORMAL is durable in WAL mode except for the last commits before a power loss
+    "synchronous": os.environ.get("DB_SYNCHRONOUS", "NORMAL").upper(),
+    # Bytes of the database file to memory map
+    "mmap_size": int(os.environ.get("DB_MMAP_SIZE", str(64 * 1024 * 1024))),
+    # Negative values are in KiB rather than pages
+    "cache_size": int(os.environ.get("DB_CACHE_SIZE", "-8000")),
+}
+
+# The number of threads that may run read queries at once
+DB_READ_WORKERS = int(os.environ.get("DB_READ_WORKERS", "4"))
+
+SYNCHRONOUS_SETTINGS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# Queries are run on these executors so that the event loops never block on disk I/O.
+# Every write goes through a single thread so writes never contend with one another for
+# SQLite's write lock, while WAL mode (if enabled) lets reads carry on alongside them.
+_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db_writer")
+_READ_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DB_READ_WORKERS, thread_name_prefix="db_reader"
+)
+
+
+class ConnectionPool:
+    """
+    Keeps long-lived SQLite connections around so they can be reused
+    rather than opening a new one for every query.
+
+    A connection is only ever handed to one caller at a time, but it may be handed to
+    callers on different threads over its lifetime. This lets the pool be shared by the
+    background threads and the web server.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        if DB_PRAGMAS["synchronous"] not in SYNCHRONOUS_SETTINGS:
+            raise ValueError(
+                f"DB_SYNCHRONOUS must be one of {', '.join(sorted(SYNCHRONOUS_SETTINGS))}"
+            )
+
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+        )
+
+        for pragma, value in DB_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Hands out an idle connection, or opens a new one if none are idle."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """
+        Returns a connection to the pool.
+
+        Uncommitted work is rolled back and connections that were closed while
+        checked out are discarded. Connections beyond the pool's size are closed.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.ProgrammingError:
+            # The connection has already been closed
+            return
+
+        if self._idle.qsize() >= self.size:
+            conn.close()
+            return
+
+        self._idle.put_nowait(conn)
+
+    def close(self) -> None:
+        """
+        Closes every idle connection, first copying any writes still in the write-ahead
+        log into the database file so that nothing is lost if only that file is kept.
+        """
+        conn = self.acquire()
+
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            conn.close()
+
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the connection pool for the database, creating it on first use."""
+    global _POOL  # pylint: disable=global-statement
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ConnectionPool(DB_PATH)
+
+        return _POOL
+
+
+def close_pool() -> None:
+    """Closes the connection pool, if one was created, when the bot shuts down."""
+    global _POOL  # pylint: disable=global-statement
+
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.close()
+            _POOL = None
+
 
 def get_connection(commit: bool = False) -> Generator:
     """
-    Yields a SQLite connection to another method.
+    Yields a pooled SQLite connection to another method.
 
     Once the other method has finished,
     the transaction if committed if the commit parameter is true,
-    and then the connection is always closed.
+    and then the connection is always returned to the pool.
     """
-    conn = sqlite3.connect(DB_PATH)
+    pool = get_pool()
+    conn = pool.acquire()
+
+    try:
+        yield conn
 
-    yield conn
+        if commit:
+            conn.commit()
+    finally:
+        pool.release(conn)
 
-    if commit:
-        conn.commit()
 
-    conn.close()
+def run_in_executor(write: bool = False):
+    """
+    Turns a function that queries the database into a coroutine
+    that runs the query on one of the database executors.
 
+    Pass write=True for anything that modifies the database so that
+    it is run on the single writer thread.
 
-def create_tables():
-    """Create database tables needed for slack events bot"""
-    for conn in get_connection(commit=True):
-        cur = conn.cursor()
-        cur.executescript(
-            """
-            CREATE TABLE IF NOT EXISTS channels (
-                id integer PRIMARY KEY AUTOINCREMENT NOT NULL,
-                slack_channel_id TEXT UNIQUE NOT NULL
-            );
-
-            CREATE INDEX IF NOT EXISTS slack_channel_id_index ON channels (slack_channel_id);
-
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                week DATE NOT NULL,
-                message_timestamp TEXT NOT NULL,
-                message TEXT NOT NULL,
-                sequence_position INTEGER DEFAULT 0 NOT NULL,
-                channel_id INTEGER NOT NULL,
-                    CONSTRAINT fk_channel_id
-                    FOREIGN KEY(channel_id) REFERENCES channels(id)
-                    ON DELETE CASCADE
-            );
-
-            CREATE INDEX IF NOT EXISTS week_index ON messages (week);
-
-            CREATE TABLE IF NOT EXISTS cooldowns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                -- Unique identifier from whomever is accessing the resource.
-                -- Can be a workspace, channel, user, etc..
-                accessor TEXT NOT NULL,
-                -- Unique identifier for whatever is rate-limited.
-                -- Can be a method name, service name, etc..
-                resource TEXT NOT NULL,
-                -- ISO8601 timestamp for when the accessor
-                -- will be allowed to access the resource once again.
-                expires_at TEXT NOT NULL,
-                UNIQUE(accessor,resource)
-            );
-
-            CREATE INDEX IF NOT EXISTS accessor_resource_index ON
-                cooldowns (accessor, resource);
-        """
+    The coroutine's submit method queues the query without waiting on it, and returns
+    a concurrent.futures.Future for its result. Queued queries still run if the event
+    loop that queued them goes away.
+    """
+
+    def decorator(query):
+        executor = _WRITE_EXECUTOR if write else _READ_EXECUTOR
+
+        @functools.wraps(query)
+        async def executor_wrapper(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, functools.partial(query, *args, **kwargs)
+            )
+
+        executor_wrapper.submit = functools.partial(executor.submit, query)
+
+        return executor_wrapper
+
+    return decorator
+
+
+def _create_initial_tables(cur: sqlite3.Cursor):
+    """Creates the tables as they were before migrations were tracked"""
+    for statement in [
+        """CREATE TABLE IF NOT EXISTS channels (
+            id integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+            slack_channel_id TEXT UNIQUE NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS slack_channel_id_index ON channels (slack_channel_id)",
+        """CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            week DATE NOT NULL,
+            message_timestamp TEXT NOT NULL,
+            message TEXT NOT NULL,
+            sequence_position INTEGER DEFAULT 0 NOT NULL,
+            channel_id INTEGER NOT NULL,
+                CONSTRAINT fk_channel_id
+                FOREIGN KEY(channel_id) REFERENCES channels(id)
+                ON DELETE CASCADE
+        )""",
+        "CREATE INDEX IF NOT EXISTS week_index ON messages (week)",
+        """CREATE TABLE IF NOT EXISTS cooldowns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            -- Unique identifier from whomever is accessing the resource.
+            -- Can be a workspace, channel, user, etc..
+            accessor TEXT NOT NULL,
+            -- Unique identifier for whatever is rate-limited.
+            -- Can be a method name, service name, etc..
+            resource TEXT NOT NULL,
+            -- ISO8601 timestamp for when the accessor
+            -- will be allowed to access the resource once again.
+            expires_at TEXT NOT NULL,
+            UNIQUE(accessor,resource)
+        )""",
+        """CREATE INDEX IF NOT EXISTS accessor_resource_index ON
+            cooldowns (accessor, resource)""",
+        # A digest of the events that were posted in a channel for a week.
+        # Lets us know that nothing needs to be done if they haven't changed.
+        """CREATE TABLE IF NOT EXISTS week_digests (
+            week DATE NOT NULL,
+            digest TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+                CONSTRAINT fk_channel_id
+                FOREIGN KEY(channel_id) REFERENCES channels(id)
+                ON DELETE CASCADE,
+            UNIQUE(week, channel_id)
+        )""",
+        # Events rendered into blocks and text, kept so they can be reused
+        """CREATE TABLE IF NOT EXISTS rendered_events (
+            uuid TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            tz TEXT NOT NULL,
+            render_version INTEGER NOT NULL,
+            -- JSON encoded blocks, text, and text length
+            rendered TEXT NOT NULL,
+            -- Unix timestamp for when the rendered event was last saved
+            used_at REAL NOT NULL,
+            PRIMARY KEY (uuid, content_hash, tz, render_version)
+        )""",
+        "CREATE INDEX IF NOT EXISTS used_at_index ON rendered_events (used_at)",
+    ]:
+        cur.execute(statement)
+
+
+def _add_message_event_uuids(cur: sqlite3.Cursor):
+    """Records the uuids of the events in each message"""
+    cur.execute("PRAGMA table_info(messages)")
+
+    # Databases created before migrations were tracked may already have the column
+    if "event_uuids" not in [column[1] for column in cur.fetchall()]:
+        # JSON encoded list of the uuids of the events in the message
+        cur.execute("ALTER TABLE messages ADD COLUMN event_uuids TEXT")
+
+
+def _rebuild_messages(cur: sqlite3.Cursor):
+    """
+    Rebuilds the messages table as a strict table that stores when each message was
+    posted as a number, so that old messages can be found using an index, and indexes
+    it for each of the ways it's queried
+    """
+    for statement in [
+        """CREATE TABLE new_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            week TEXT NOT NULL,
+            message_timestamp TEXT NOT NULL,
+            -- message_timestamp as a Unix timestamp
+            posted_at REAL NOT NULL,
+            message TEXT NOT NULL,
+            sequence_position INTEGER DEFAULT 0 NOT NULL,
+            -- JSON encoded list of the uuids of the events in the message
+            event_uuids TEXT,
+            channel_id INTEGER NOT NULL,
+                CONSTRAINT fk_channel_id
+                FOREIGN KEY(channel_id) REFERENCES channels(id)
+                ON DELETE CASCADE
+        ) STRICT""",
+        """INSERT INTO new_messages (
+            id,
+            week,
+            message_timestamp,
+            posted_at,
+            message,
+            sequence_position,
+            event_uuids,
+            channel_id
         )
+        SELECT
+            id,
+            week,
+            message_timestamp,
+            CAST(message_timestamp AS REAL),
+            message,
+            sequence_position,
+            event_uuids,
+            channel_id
+        FROM messages""",
+        "DROP TABLE messages",
+        "ALTER TABLE new_messages RENAME TO messages",
+        # Finds a week's messages already in order
+        """CREATE INDEX messages_week_position_index ON
+            messages (week, sequence_position)""",
+        # Finds a channel's latest week and its messages
+        """CREATE INDEX messages_channel_week_timestamp_index ON
+            messages (channel_id, week, message_timestamp)""",
+        "CREATE INDEX messages_posted_at_index ON messages (posted_at)",
+    ]:
+        cur.execute(statement)
+
+
+def _rebuild_week_digests(cur: sqlite3.Cursor):
+    """
+    Rebuilds the week digests table so that its rows are stored in the index on
+    their week and channel, which is the only way they're looked up
+    """
+    for statement in [
+        """CREATE TABLE new_week_digests (
+            week TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+                CONSTRAINT fk_channel_id
+                FOREIGN KEY(channel_id) REFERENCES channels(id)
+                ON DELETE CASCADE,
+            PRIMARY KEY(week, channel_id)
+        ) STRICT, WITHOUT ROWID""",
+        """INSERT OR REPLACE INTO new_week_digests (week, digest, channel_id)
+        SELECT week, digest, channel_id FROM week_digests""",
+        "DROP TABLE week_digests",
+        "ALTER TABLE new_week_digests RENAME TO week_digests",
+    ]:
+        cur.execute(statement)
+
+
+def _tidy_indexes(cur: sqlite3.Cursor):
+    """
+    Drops indexes that duplicate the ones behind UNIQUE constraints and indexes
+    cooldowns by when they expire so that expired ones can be found quickly
+    """
+    for statement in [
+        "DROP INDEX IF EXISTS slack_channel_id_index",
+        "DROP INDEX IF EXISTS accessor_resource_index",
+        "CREATE INDEX cooldowns_expires_at_index ON cooldowns (expires_at)",
+    ]:
+        cur.execute(statement)
+
+
+# Every change made to the database's schema, in order. The schema's version is the
+# number of migrations that have been applied, so never remove or reorder them.
+MIGRATIONS = [
+    _create_initial_tables,
+    _add_message_event_uuids,
+    _rebuild_messages,
+    _rebuild_week_digests,
+    _tidy_indexes,
+]
+
+
+def get_schema_version(cur: sqlite3.Cursor) -> int:
+    """Returns the number of migrations that have been applied to the database"""
+    cur.execute("SELECT version FROM schema_version")
+    version = cur.fetchone()
+
+    return version[0] if version is not None else 0
+
 
+def migrate(conn: sqlite3.Connection, migrations: list | None = None) -> int:
+    """
+    Applies any migrations that haven't been applied to the database yet,
+    each in its own transaction along with the bump to the schema's version.
+
+    Returns the schema's version once it's up to date.
+    """
+    migrations = migrations if migrations is not None else MIGRATIONS
+
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL) STRICT"
+    )
+
+    if get_schema_version(cur) >= len(migrations):
+        return len(migrations)
+
+    for version, migration in enumerate(migrations, start=1):
+        # Take the write lock before checking the version so that two processes
+        # starting at once can't both apply the same migration
+        cur.execute("BEGIN IMMEDIATE")
+
+        try:
+            if get_schema_version(cur) < version:
+                logging.info("Migrating the database to version %s", version)
+                migration(cur)
+                cur.execute("DELETE FROM schema_version")
+                cur.execute(
+                    "INSERT INTO schema_version (version) VALUES (?)", [version]
+                )
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-async def create_message(
-    week, message, message_timestamp, slack_channel_id, sequence_position: int
+    return get_schema_version(cur)
+
+
+def create_tables():
+    """Create database tables needed for slack events bot"""
+    for conn in get_connection():
+        migrate(conn)
+
+
+# The database's channel id is looked up for the slack channel id within each statement
+CREATE_MESSAGE_SQL = """INSERT INTO messages (
+        week,
+        message,
+        message_timestamp,
+        posted_at,
+        channel_id,
+        sequence_position,
+        event_uuids
+    )
+    SELECT ?, ?, ?, ?, id, ?, ? FROM channels WHERE slack_channel_id = ?"""
+
+UPDATE_MESSAGE_SQL = """UPDATE messages
+    SET message = ?, event_uuids = ?
+    WHERE week = ? AND message_timestamp = ? AND channel_id = (
+        SELECT id FROM channels WHERE slack_channel_id = ?
+    )"""
+
+SET_WEEK_DIGEST_SQL = """INSERT INTO week_digests (week, digest, channel_id)
+    SELECT ?, ?, id FROM channels WHERE slack_channel_id = ?
+    ON CONFLICT(week, channel_id) DO UPDATE SET digest=excluded.digest"""
+
+# The most writes a MessageBatch will hold onto before committing them
+DB_BATCH_FLUSH_SIZE = int(os.environ.get("DB_BATCH_FLUSH_SIZE", "100"))
+
+
+def encode_event_uuids(event_uuids: list | None) -> str | None:
+    """Encodes the uuids of the events in a message so they can be stored"""
+    return json.dumps(event_uuids) if event_uuids is not None else None
+
+
+@run_in_executor(write=True)
+def create_message(
+    week,
+    message,
+    message_timestamp,
+    slack_channel_id,
+    sequence_position: int,
+    event_uuids: list | None = None,
 ):
     """Create a record of a message sent in slack for a week"""
+    # pylint: disable=too-many-arguments
     for conn in get_connection(commit=True):
         cur = conn.cursor()
-        # get database's channel id for slack channel id
         cur.execute(
-            "SELECT id FROM channels WHERE slack_channel_id = ?", [slack_channel_id]
+            CREATE_MESSAGE_SQL,
+            [
+                week,
+                message,
+                message_timestamp,
+                float(message_timestamp),
+                sequence_position,
+                encode_event_uuids(event_uuids),
+                slack_channel_id,
+            ],
         )
-        channel_id = cur.fetchone()[0]
 
+
+@run_in_executor(write=True)
+def update_message(
+    week, message, message_timestamp, slack_channel_id, event_uuids: list | None = None
+):
+    """Updates a record of a message sent in slack for a week"""
+    for conn in get_connection(commit=True):
+        cur = conn.cursor()
         cur.execute(
-            """INSERT INTO messages (
-                    week, message, message_timestamp, channel_id, sequence_position
-                )
-                VALUES (?, ?, ?, ?, ?)""",
-            [week, message, message_timestamp, channel_id, sequence_position],
+            UPDATE_MESSAGE_SQL,
+            [
+                message,
+                encode_event_uuids(event_uuids),
+                week,
+                message_timestamp,
+                slack_channel_id,
+            ],
         )
 
 
-async def update_message(week, message, message_timestamp, slack_channel_id):
-    """Updates a record of a message sent in slack for a week"""
+@run_in_executor(write=True)
+def write_message_batch(
+    created_messages: list, updated_messages: list, week_digests: list
+):
+    """
+    Creates and updates records of messages sent in slack,
+    along with the digests of their weeks, in a single transaction
+    """
     for conn in get_connection(commit=True):
         cur = conn.cursor()
-        # get database's channel id for slack channel id
-        cur.execute(
-            "SELECT id FROM channels WHERE slack_channel_id = ?", [slack_channel_id]
+        cur.executemany(CREATE_MESSAGE_SQL, created_messages)
+        cur.executemany(UPDATE_MESSAGE_SQL, updated_messages)
+        cur.executemany(SET_WEEK_DIGEST_SQL, week_digests)
+
+
+class MessageBatch:
+    """
+    Collects the records of messages sent in slack so that they can all be
+    written in one transaction rather than one for every message.
+
+    Use it as an async context manager. Whatever has been collected is written once the
+    block exits, even if it exits with an error, so a message that made it to Slack is
+    recorded as long as the process is still alive. To limit how much could be lost if
+    the process is killed outright, flush the batch whenever a unit of work finishes;
+    it also writes whenever it has collected DB_BATCH_FLUSH_SIZE records. If a write
+    fails, the records are logged so that they can be recovered by hand.
+    """
+
+    def __init__(self, flush_size: int = DB_BATCH_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self._created_messages = []
+        self._updated_messages = []
+        self._week_digests = []
+
+    async def create_message(
+        self,
+        week,
+        message,
+        message_timestamp,
+        slack_channel_id,
+        sequence_position,
+        event_uuids: list | None = None,
+    ):
+        """Queues up the creation of a record of a message sent in slack for a week"""
+        # pylint: disable=too-many-arguments
+        self._created_messages.append(
+            [
+                week,
+                message,
+                message_timestamp,
+                float(message_timestamp),
+                sequence_position,
+                encode_event_uuids(event_uuids),
+                slack_channel_id,
+            ]
         )
-        channel_id = cur.fetchone()[0]
 
-        cur.execute(
-            """UPDATE messages
-                SET message = ?
-                WHERE week = ? AND message_timestamp = ? AND channel_id = ?""",
-            [message, week, message_timestamp, channel_id],
+        if len(self) >= self.flush_size:
+            await self.flush()
+
+    async def update_message(
+        self,
+        week,
+        message,
+        message_timestamp,
+        slack_channel_id,
+        event_uuids: list | None = None,
+    ):
+        """Queues up an update to the record of a message sent in slack for a week"""
+        # pylint: disable=too-many-arguments
+        self._updated_messages.append(
+            [
+                message,
+                encode_event_uuids(event_uuids),
+                week,
+                message_timestamp,
+                slack_channel_id,
+            ]
+        )
+
+        if len(self) >= self.flush_size:
+            await self.flush()
+
+    async def set_week_digest(self, week, slack_channel_id, digest: str):
+        """
+        Queues up recording the digest of the events posted in slack for a week.
+
+        Queue this after the channel's messages so that the digest is never
+        written without them.
+        """
+        self._week_digests.append([week, digest, slack_channel_id])
+
+        if len(self) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """Writes everything that has been collected so far"""
+        if len(self) == 0:
+            return
+
+        created_messages, self._created_messages = self._created_messages, []
+        updated_messages, self._updated_messages = self._updated_messages, []
+        week_digests, self._week_digests = self._week_digests, []
+
+        try:
+            await write_message_batch(created_messages, updated_messages, week_digests)
+        except Exception:
+            logging.error(
+                "Failed to record messages sent in slack. Created: %s --- Updated: %s",
+                created_messages,
+                updated_messages,
+            )
+            raise
+
+    def __len__(self) -> int:
+        return (
+            len(self._created_messages)
+            + len(self._updated_messages)
+            + len(self._week_digests)
         )
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.flush()
 
-async def get_messages(week) -> list:
+
+def encode_weeks(weeks: list) -> str:
+    """
+    Encodes a list of weeks as a single JSON parameter, so that queries can look up any
+    number of weeks at once with json_each. Weeks are stored as their string form.
+    """
+    return json.dumps([str(week) for week in weeks])
+
+
+GET_MESSAGES_SQL = """SELECT
+        m.message,
+        m.message_timestamp,
+        c.slack_channel_id,
+        m.sequence_position,
+        m.event_uuids
+    FROM messages m
+    JOIN channels c ON m.channel_id = c.id
+    WHERE m.week = ?
+    ORDER BY m.sequence_position ASC"""
+
+
+@run_in_executor()
+def get_messages(week) -> list:
     """Get all messages sent in slack for a week"""
     for conn in get_connection():
         cur = conn.cursor()
-        cur.execute(
-            """SELECT m.message, m.message_timestamp, c.slack_channel_id, m.sequence_position
-                FROM messages m
-                JOIN channels c ON m.channel_id = c.id
-                WHERE m.week = ?
-                ORDER BY m.sequence_position ASC""",
-            [week],
-        )
+        cur.execute(GET_MESSAGES_SQL, [week])
         return [
             {
                 "message": x[0],
                 "message_timestamp": x[1],
                 "slack_channel_id": x[2],
                 "sequence_position": x[3],
+                "event_uuids": json.loads(x[4]) if x[4] is not None else None,
             }
             for x in cur.fetchall()
         ]
@@ -137,86 +676,186 @@ async def get_messages(week) -> list:
     return []
 
 
-async def get_most_recent_message_for_channel(slack_channel_id) -> dict:
-    """Get the most recently posted message for a subscribed Slack channel"""
+GET_WEEKS_DIGESTS_SQL = """SELECT d.week, c.slack_channel_id, d.digest
+    FROM week_digests d
+    JOIN channels c ON d.channel_id = c.id
+    WHERE d.week IN (SELECT value FROM json_each(?))"""
+
+
+@run_in_executor()
+def get_weeks_digests(weeks: list) -> dict:
+    """
+    Get the digest of the events posted in each slack channel for several weeks at once,
+    keyed by week and then by slack channel
+    """
+    digests = {str(week): {} for week in weeks}
+
     for conn in get_connection():
         cur = conn.cursor()
-        cur.execute(
-            """SELECT m.week, m.message, m.message_timestamp
-                    FROM messages m
-                    JOIN channels c ON m.channel_id = c.id
-                    WHERE c.slack_channel_id = ?
-                    ORDER BY
-                        m.week DESC,
-                        m.message_timestamp DESC
-                    LIMIT 1
-                """,
-            [slack_channel_id],
-        )
+        cur.execute(GET_WEEKS_DIGESTS_SQL, [encode_weeks(weeks)])
 
-        most_recent_message = cur.fetchone()
+        for week, slack_channel_id, digest in cur.fetchall():
+            digests[week][slack_channel_id] = digest
+
+    return digests
+
+
+GET_WEEKS_MESSAGES_SQL = """SELECT
+        m.week,
+        m.message,
+        m.message_timestamp,
+        c.slack_channel_id,
+        m.sequence_position,
+        m.event_uuids
+    FROM messages m
+    JOIN channels c ON m.channel_id = c.id
+    WHERE m.week IN (SELECT value FROM json_each(?))
+    ORDER BY m.week ASC, m.sequence_position ASC"""
 
-        if most_recent_message:
-            return {
-                "week": most_recent_message[0],
-                "message": most_recent_message[1],
-                "message_timestamp": most_recent_message[2],
-            }
+
+@run_in_executor()
+def get_weeks_messages(weeks: list) -> dict:
+    """Get all messages sent in slack for several weeks at once, keyed by week"""
+    messages = {str(week): [] for week in weeks}
+
+    for conn in get_connection():
+        cur = conn.cursor()
+        cur.execute(GET_WEEKS_MESSAGES_SQL, [encode_weeks(weeks)])
+
+        for x in cur.fetchall():
+            messages[x[0]].append(
+                {
+                    "message": x[1],
+                    "message_timestamp": x[2],
+                    "slack_channel_id": x[3],
+                    "sequence_position": x[4],
+                    "event_uuids": json.loads(x[5]) if x[5] is not None else None,
+                }
+            )
+
+    return messages
+
+
+GET_CHANNEL_STATES_SQL = """SELECT c.slack_channel_id, latest.week, COUNT(m.id)
+    FROM (
+        SELECT channel_id, MAX(week) AS week
+        FROM messages
+        GROUP BY channel_id
+    ) latest
+    JOIN channels c ON latest.channel_id = c.id
+    JOIN messages m
+        ON m.channel_id = latest.channel_id AND m.week = latest.week
+    GROUP BY latest.channel_id"""
+
+
+@run_in_executor()
+def get_channel_states() -> dict:
+    """
+    Get the latest week that messages were posted for, and how many messages were posted
+    for it, in every subscribed Slack channel that has any messages
+    """
+    for conn in get_connection():
+        cur = conn.cursor()
+        cur.execute(GET_CHANNEL_STATES_SQL)
+        return {x[0]: {"week": x[1], "message_count": x[2]} for x in cur.fetchall()}
 
     return {}
 
 
-async def get_slack_channel_ids() -> list:
+GET_SLACK_CHANNEL_IDS_SQL = "SELECT slack_channel_id FROM channels"
+
+
+@run_in_executor()
+def get_slack_channel_ids() -> list:
     """Get all slack channels that the bot is configured for"""
     for conn in get_connection():
         cur = conn.cursor()
-        cur.execute("SELECT slack_channel_id FROM channels")
+        cur.execute(GET_SLACK_CHANNEL_IDS_SQL)
         return [x[0] for x in cur.fetchall()]
 
     return []
 
 
-async def add_channel(slack_channel_id):
+ADD_CHANNEL_SQL = "INSERT INTO channels (slack_channel_id) VALUES (?)"
+
+
+@run_in_executor(write=True)
+def add_channel(slack_channel_id):
     """Add a slack channel to post in for the bot"""
     for conn in get_connection(commit=True):
         cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO channels (slack_channel_id) VALUES (?)", [slack_channel_id]
-        )
+        cur.execute(ADD_CHANNEL_SQL, [slack_channel_id])
+
 
+REMOVE_CHANNEL_SQL = "DELETE FROM channels WHERE slack_channel_id = ?"
 
-async def remove_channel(channel_id):
+
+@run_in_executor(write=True)
+def remove_channel(channel_id):
     """Remove a slack channel to post in from the bot"""
     for conn in get_connection(commit=True):
         cur = conn.cursor()
-        cur.execute("DELETE FROM channels WHERE slack_channel_id = ?", [channel_id])
+        cur.execute(REMOVE_CHANNEL_SQL, [channel_id])
+
+
+GET_RENDERED_EVENTS_SQL = """SELECT uuid, content_hash, tz, render_version, rendered
+    FROM rendered_events
+    ORDER BY used_at DESC
+    LIMIT ?"""
+
+
+@run_in_executor()
+def get_rendered_events(limit: int) -> list:
+    """
+    Get the most recently used rendered events as tuples of their uuid, content hash,
+    timezone, render version, and JSON encoded rendering
+    """
+    for conn in get_connection():
+        cur = conn.cursor()
+        cur.execute(GET_RENDERED_EVENTS_SQL, [limit])
+        return cur.fetchall()
+
+    return []
+
+
+SAVE_RENDERED_EVENT_SQL = """INSERT INTO rendered_events (
+        uuid, content_hash, tz, render_version, rendered, used_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(uuid, content_hash, tz, render_version) DO UPDATE SET
+        rendered=excluded.rendered,
+        used_at=excluded.used_at"""
 
+DELETE_RENDERED_EVENT_SQL = """DELETE FROM rendered_events
+    WHERE uuid = ? AND content_hash = ? AND tz = ? AND render_version = ?"""
+
+
+@run_in_executor(write=True)
+def save_rendered_events(upserts: list, deletes: list):
+    """
+    Saves rendered events, given as lists of their uuid, content hash, timezone,
+    render version, and JSON encoded rendering, and deletes any that have been evicted
+    """
+    used_at = time.time()
 
-async def delete_old_messages(days_back=90):
-    """delete all messages and cooldowns with timestamp older than current timestamp - days_back"""
     for conn in get_connection(commit=True):
         cur = conn.cursor()
-        cur.execute(
-            "DELETE FROM messages where cast(message_timestamp as decimal) < ?",
-            [
-                (
-                    datetime.datetime.now(datetime.timezone.utc)
-                    - datetime.timedelta(days=days_back)
-                ).timestamp()
-            ],
-        )
-        cur.execute(
-            "DELETE FROM cooldowns where expires_at < ?",
-            [
-                (
-                    datetime.datetime.now(datetime.timezone.utc)
-                    - datetime.timedelta(days=days_back)
-                ).isoformat()
-            ],
+        cur.executemany(
+            SAVE_RENDERED_EVENT_SQL, [[*upsert, used_at] for upsert in upserts]
         )
+        cur.executemany(DELETE_RENDERED_EVENT_SQL, deletes)
+
+
+CREATE_COOLDOWN_SQL = """INSERT INTO cooldowns (accessor, resource, expires_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT(accessor,resource) DO UPDATE SET
+        accessor=excluded.accessor,
+        resource=excluded.resource,
+        expires_at=excluded.expires_at"""
 
 
-async def create_cooldown(accessor: str, resource: str, cooldown_minutes: int) -> None:
+@run_in_executor(write=True)
+def create_cooldown(accessor: str, resource: str, cooldown_minutes: int) -> None:
     """
     Upserts a cooldown record for an entity which will let the system know when to make the resource
     available to them once again.
@@ -224,13 +863,7 @@ async def create_cooldown(accessor: str, resource: str, cooldown_minutes: int) -
     for conn in get_connection(commit=True):
         cur = conn.cursor()
         cur.execute(
-            """INSERT INTO cooldowns (accessor, resource, expires_at)
-                VALUES (?, ?, ?)
-                ON CONFLICT(accessor,resource) DO UPDATE SET
-                    accessor=excluded.accessor,
-                    resource=excluded.resource,
-                    expires_at=excluded.expires_at
-            """,
+            CREATE_COOLDOWN_SQL,
             [
                 accessor,
                 resource,
@@ -242,20 +875,22 @@ async def create_cooldown(accessor: str, resource: str, cooldown_minutes: int) -
         )
 
 
-async def get_cooldown_expiry_time(accessor: str, resource: str) -> Union[str, None]:
+GET_ACTIVE_COOLDOWNS_SQL = """SELECT accessor, resource, expires_at FROM cooldowns
+    WHERE expires_at > ?"""
+
+
+@run_in_executor()
+def get_active_cooldowns() -> list:
     """
-    Returns the time at which an accessor is able to access a resource
-    or None if no restriction has ever been put in place.
+    Returns every cooldown that hasn't expired yet
+    as tuples of its accessor, resource, and ISO8601 expiry time
     """
     for conn in get_connection():
         cur = conn.cursor()
         cur.execute(
-            """SELECT expires_at FROM cooldowns
-            WHERE accessor = ? AND resource = ?
-            """,
-            [accessor, resource],
+            GET_ACTIVE_COOLDOWNS_SQL,
+            [datetime.datetime.now(datetime.timezone.utc).isoformat()],
         )
+        return cur.fetchall()
 
-        expiry_time = cur.fetchone()
-
-        return expiry_time[0] if expiry_time is not None else None
+    return []
@@ -1,5 +1,10 @@
 """Contains the event class, which holds information for an event"""
 
+import dataclasses
+import datetime
+import functools
+import hashlib
+import json
 import os
 import urllib
 
@@ -64,33 +69,46 @@ def print_status(status):
     return status.title()
 
 
+@functools.cache
+def get_local_timezone():
+    """Returns the timezone named by the TZ environment variable, looked up only once"""
+    return pytz.timezone(os.environ.get("TZ"))
+
+
 def print_datetime(time):
     """Print datetime in local timezone as string"""
-    return time.astimezone(pytz.timezone(os.environ.get("TZ"))).strftime(
-        "%B %-d, %Y %I:%M %p %Z"
-    )
+    return time.astimezone(get_local_timezone()).strftime("%B %-d, %Y %I:%M %p %Z")
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
 class Event:
     """Event records all the data from an event, and has methods to generate the
     message from an event
+
+    Events are immutable, which lets them render their blocks and text just once
+    no matter how many weeks or channels they end up being posted for.
     """
 
     # pylint: disable=too-many-instance-attributes
     # Events have lots of data that we need to save together
 
-    def __init__(
-        self, title, group_name, description, location, time, url, status, uuid
-    ):
-        # pylint: disable=too-many-arguments
-        self.title = title
-        self.group_name = group_name
-        self.description = description
-        self.location = location
-        self.time = time
-        self.url = url
-        self.status = status
-        self.uuid = uuid
+    title: str
+    group_name: str
+    description: str
+    location: str | None
+    time: datetime.datetime
+    url: str
+    status: str
+    uuid: str
+    _blocks: list | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _text: str | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _content_hash: str | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     # creates a struct of event information used to compose different formats of the event message
     @classmethod
@@ -107,39 +125,87 @@ class Event:
             uuid=event_json["uuid"],
         )
 
+    def get_content_hash(self) -> str:
+        """Returns a hash of everything about the event that goes into its message"""
+        if self._content_hash is None:
+            object.__setattr__(
+                self,
+                "_content_hash",
+                hashlib.sha256(
+                    json.dumps(
+                        [
+                            self.uuid,
+                            self.title,
+                            self.group_name,
+                            self.description,
+                            self.location,
+                            self.time.isoformat(),
+                            self.url,
+                            self.status,
+                        ]
+                    ).encode("utf-8")
+                ).hexdigest(),
+            )
+
+        return self._content_hash
+
     def generate_blocks(self):
-        """Compose part of a slack message using the blocks layout"""
-        return [
-            {
-                "type": "header",
-                "text": {"type": "plain_text", "text": truncate_string(self.title)},
-            },
-            {
-                "type": "section",
-                "text": {
-                    "type": "plain_text",
-                    "text": truncate_string(self.description),
-                },
-                "fields": [
-                    {"type": "mrkdwn", "text": f"*{truncate_string(self.group_name)}*"},
-                    {"type": "mrkdwn", "text": f"<{self.url}|*Link* :link:>"},
-                    {"type": "mrkdwn", "text": "*Status*"},
-                    {"type": "mrkdwn", "text": print_status(self.status)},
-                    {"type": "mrkdwn", "text": "*Location*"},
-                    {"type": "mrkdwn", "text": get_location_url(self.location)},
-                    {"type": "mrkdwn", "text": "*Time*"},
-                    {"type": "plain_text", "text": print_datetime(self.time)},
+        """
+        Compose part of a slack message using the blocks layout
+
+        The blocks are only composed once, so they must not be modified.
+        """
+        if self._blocks is None:
+            object.__setattr__(
+                self,
+                "_blocks",
+                [
+                    {
+                        "type": "header",
+                        "text": {
+                            "type": "plain_text",
+                            "text": truncate_string(self.title),
+                        },
+                    },
+                    {
+                        "type": "section",
+                        "text": {
+                            "type": "plain_text",
+                            "text": truncate_string(self.description),
+                        },
+                        "fields": [
+                            {
+                                "type": "mrkdwn",
+                                "text": f"*{truncate_string(self.group_name)}*",
+                            },
+                            {"type": "mrkdwn", "text": f"<{self.url}|*Link* :link:>"},
+                            {"type": "mrkdwn", "text": "*Status*"},
+                            {"type": "mrkdwn", "text": print_status(self.status)},
+                            {"type": "mrkdwn", "text": "*Location*"},
+                            {"type": "mrkdwn", "text": get_location_url(self.location)},
+                            {"type": "mrkdwn", "text": "*Time*"},
+                            {"type": "plain_text", "text": print_datetime(self.time)},
+                        ],
+                    },
                 ],
-            },
-        ]
+            )
+
+        return self._blocks
 
     def generate_text(self):
         """Compose a text string of event information for backup"""
-        return (
-            f"{truncate_string(self.title)}\n"
-            f"Description: {truncate_string(self.description)}\n"
-            f"Link: {self.url}\n"
-            f"Status: {print_status(self.status)}\n"
-            f"Location: {self.location}\n"
-            f"Time: {print_datetime(self.time)}"
-        )
+        if self._text is None:
+            object.__setattr__(
+                self,
+                "_text",
+                (
+                    f"{truncate_string(self.title)}\n"
+                    f"Description: {truncate_string(self.description)}\n"
+                    f"Link: {self.url}\n"
+                    f"Status: {print_status(self.status)}\n"
+                    f"Location: {self.location}\n"
+                    f"Time: {print_datetime(self.time)}"
+                ),
+            )
+
+        return self._text
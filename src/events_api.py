@@ -0,0 +1,300 @@
+"""
+Fetches the events feed from HackGreenville Labs' Events API.
+
+The last response is kept on disk along with its ETag and Last-Modified validators
+so that subsequent requests can be made conditionally. Whenever the feed hasn't
+changed the API answers with a 304 and the cached copy is used instead,
+which also means a restart doesn't force the whole feed to be downloaded again.
+
+The feed covers every event there has ever been, so it is never held in memory whole.
+It is streamed to disk a chunk at a time and its events are decoded one by one as
+the cached copy is read back.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import json
+import logging
+import os
+from collections.abc import AsyncIterator
+from typing import BinaryIO
+
+import aiohttp
+
+from database import DB_PATH
+
+EVENTS_API_URL = (
+    os.environ.get("EVENTS_API_URL") or "https://events.openupstate.org/api/gtc"
+)
+
+# Where the last response from the events API is kept. Defaults to alongside the database.
+EVENTS_CACHE_DIR = os.environ.get("EVENTS_CACHE_DIR", os.path.dirname(DB_PATH))
+
+
+# Bytes read from the feed at a time, whether from the API or from the cache
+FEED_CHUNK_SIZE = 64 * 1024
+
+
+def _decode_item(decoder: json.JSONDecoder, buffer: str, pos: int, final: bool):
+    """
+    Returns the JSON value at pos and where it ends, or None if the value might
+    not have been read in full yet.
+    """
+    try:
+        item, end = decoder.raw_decode(buffer, pos)
+    except json.JSONDecodeError:
+        if final:
+            raise
+        return None
+
+    # A number at the very end of the buffer might continue in the next chunk
+    if end == len(buffer) and not final:
+        return None
+
+    return item, end
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator:
+    """
+    Decodes the items of a JSON array one at a time as its bytes arrive,
+    so that the whole array never has to be held in memory at once.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = aiter(chunks)
+    buffer = ""
+    pos = 0
+    started = exhausted = False
+
+    while True:
+        # Skip past whitespace and the commas between items
+        while pos < len(buffer) and (
+            buffer[pos].isspace() or (started and buffer[pos] == ",")
+        ):
+            pos += 1
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected the feed to be a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            decoded = _decode_item(decoder, buffer, pos, exhausted)
+
+            if decoded is not None:
+                item, pos = decoded
+                yield item
+                continue
+
+        if exhausted:
+            raise ValueError("The feed ended before its JSON array was closed")
+
+        try:
+            chunk = await anext(chunks)
+        except StopAsyncIteration:
+            exhausted = True
+            chunk = b""
+
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=exhausted)
+        pos = 0
+
+
+class FeedResponse:
+    """
+    The events feed, whether it came from the API or from the cache.
+
+    The feed is normally read back from the cached copy on disk a chunk at a time,
+    and is only held in memory when it couldn't be cached.
+    """
+
+    def __init__(
+        self,
+        digest: str,
+        body: bytes | None = None,
+        path: str | None = None,
+        not_modified: bool = False,
+    ):
+        self.digest = digest
+        self.body = body
+        self.path = path
+        self.not_modified = not_modified
+
+    @classmethod
+    def from_body(cls, body: bytes, not_modified: bool = False):
+        """Wraps a feed that is already in memory"""
+        return cls(hashlib.sha256(body).hexdigest(), body, not_modified=not_modified)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yields the raw feed a chunk at a time"""
+        if self.body is not None:
+            for start in range(0, len(self.body), FEED_CHUNK_SIZE):
+                yield self.body[start : start + FEED_CHUNK_SIZE]
+            return
+
+        body_file = await asyncio.to_thread(open, self.path, "rb")
+
+        try:
+            while chunk := await asyncio.to_thread(body_file.read, FEED_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body_file.close()
+
+    def events(self) -> AsyncIterator[dict]:
+        """Yields each event in the feed as it is decoded"""
+        return iter_json_array(self.chunks())
+
+    async def json(self):
+        """Decodes the whole feed at once"""
+        return [event async for event in self.events()]
+
+
+class FeedCache:
+    """Keeps the last response from the events API, and its validators, on disk."""
+
+    def __init__(self, cache_dir: str):
+        self.body_path = os.path.join(cache_dir, "events-api-cache.json")
+        self.meta_path = os.path.join(cache_dir, "events-api-cache.meta.json")
+
+    def _read_meta(self, url: str) -> dict:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+
+        if meta.get("url") != url or not os.path.exists(self.body_path):
+            return {}
+
+        return meta
+
+    def get_validators(self, url: str) -> dict:
+        """
+        Returns the headers needed to make a conditional request for the feed,
+        or nothing if there isn't a cached copy of it.
+        """
+        meta = self._read_meta(url)
+        headers = {}
+
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        return headers
+
+    def read(self, url: str) -> FeedResponse:
+        """Returns the cached copy of the feed, without reading it into memory"""
+        digest = self._read_meta(url).get("digest")
+
+        if digest is None:
+            # Copies cached before digests were saved have to be hashed once
+            digest = hashlib.sha256()
+
+            with open(self.body_path, "rb") as body_file:
+                while chunk := body_file.read(FEED_CHUNK_SIZE):
+                    digest.update(chunk)
+
+            digest = digest.hexdigest()
+        elif not os.path.exists(self.body_path):
+            raise FileNotFoundError(self.body_path)
+
+        return FeedResponse(digest, path=self.body_path, not_modified=True)
+
+    def open_body(self) -> BinaryIO:
+        """Opens a temporary file for a new copy of the feed to be written to"""
+        return open(f"{self.body_path}.tmp", "wb")
+
+    def replace(self, body_file: BinaryIO, meta: dict) -> None:
+        """
+        Swaps in the copy of the feed written to body_file, along with its url,
+        validators, and digest
+        """
+        # Each file is swapped in whole so a crash never leaves a partial copy behind.
+        # The body goes first so the validators never describe a body we don't have.
+        body_file.close()
+        os.replace(body_file.name, self.body_path)
+
+        with open(f"{self.meta_path}.tmp", "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+
+
+FEED_CACHE = FeedCache(EVENTS_CACHE_DIR)
+
+
+async def download_feed(resp, url: str, cache: FeedCache) -> FeedResponse:
+    """
+    Streams the body of a response from the events API into the cache a chunk at
+    a time, hashing it along the way. The feed is only kept in memory if it
+    can't be cached.
+    """
+    digest = hashlib.sha256()
+
+    try:
+        body_file = await asyncio.to_thread(cache.open_body)
+        chunks = None
+    except OSError:
+        logging.warning("Unable to cache the events feed in %s", EVENTS_CACHE_DIR)
+        body_file = None
+        chunks = []
+
+    try:
+        async for chunk in resp.content.iter_chunked(FEED_CHUNK_SIZE):
+            digest.update(chunk)
+
+            if body_file is None:
+                chunks.append(chunk)
+            else:
+                await asyncio.to_thread(body_file.write, chunk)
+    except BaseException:
+        if body_file is not None:
+            body_file.close()
+        raise
+
+    if body_file is None:
+        return FeedResponse(digest.hexdigest(), body=b"".join(chunks))
+
+    await asyncio.to_thread(
+        cache.replace,
+        body_file,
+        {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "digest": digest.hexdigest(),
+        },
+    )
+
+    return FeedResponse(digest.hexdigest(), path=cache.body_path)
+
+
+async def fetch_events(
+    session: aiohttp.ClientSession,
+    url: str = EVENTS_API_URL,
+    cache: FeedCache = FEED_CACHE,
+    conditional: bool = True,
+) -> FeedResponse:
+    """
+    Fetches the events feed, only downloading it if it has changed
+    since the copy we have cached.
+    """
+    headers = await asyncio.to_thread(cache.get_validators, url) if conditional else {}
+
+    async with session.get(url, headers=headers) as resp:
+        if resp.status != 304 or not headers:
+            resp.raise_for_status()
+            return await download_feed(resp, url, cache)
+
+    try:
+        return await asyncio.to_thread(cache.read, url)
+    except OSError:
+        # The cached copy vanished since we checked for it, so download it again
+        return await fetch_events(session, url, cache, conditional=False)
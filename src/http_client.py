@@ -0,0 +1,124 @@
+"""
+The HTTP client that every outbound request the bot makes goes through, both to the
+events API and to Slack's Web API.
+
+Connections are pooled and kept alive between requests, DNS lookups are cached for a
+while, and every request is held to connect, read, and total timeouts. A session is
+tied to the event loop it was created on, so each loop the bot runs gets one session
+that lives as long as it does instead of one session per request.
+"""
+
+import asyncio
+import functools
+import importlib.util
+import os
+import threading
+import weakref
+
+import aiohttp
+from slack_sdk.web.async_client import AsyncWebClient
+
+# Seconds allowed for establishing a connection, including waiting for one from the pool
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+
+# Seconds allowed to pass between reads of a response
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+
+# Seconds allowed for a whole request, from connecting to reading the last byte
+HTTP_TOTAL_TIMEOUT = float(os.environ.get("HTTP_TOTAL_TIMEOUT", "60"))
+
+# The most connections each session keeps open at once
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "20"))
+
+# Seconds that a DNS lookup is reused for
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))
+
+# aiohttp can only decode brotli responses if the brotli package is installed
+ACCEPT_ENCODING = (
+    "gzip, deflate, br" if importlib.util.find_spec("brotli") else "gzip, deflate"
+)
+
+
+class HttpClient:
+    """Hands out one pooled aiohttp session per event loop and counts connection reuse"""
+
+    def __init__(self):
+        self._sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+        self._trace_config = aiohttp.TraceConfig()
+
+        async def count(stat: str, *_):
+            with self._lock:
+                self._stats[stat] += 1
+
+        for signal, stat in (
+            (self._trace_config.on_request_start, "requests"),
+            (self._trace_config.on_connection_create_end, "new_connections"),
+            (self._trace_config.on_connection_reuseconn, "reused_connections"),
+        ):
+            signal.append(functools.partial(count, stat))
+
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the session for the running event loop, creating it if need be"""
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            session = self._sessions.get(loop)
+
+            if session is None or session.closed:
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=HTTP_POOL_SIZE, ttl_dns_cache=HTTP_DNS_CACHE_TTL
+                    ),
+                    timeout=aiohttp.ClientTimeout(
+                        total=HTTP_TOTAL_TIMEOUT,
+                        connect=HTTP_CONNECT_TIMEOUT,
+                        sock_read=HTTP_READ_TIMEOUT,
+                    ),
+                    headers={"Accept-Encoding": ACCEPT_ENCODING},
+                    trace_configs=[self._trace_config],
+                )
+                self._sessions[loop] = session
+
+            return session
+
+    async def close(self) -> None:
+        """Closes the session for the running event loop, if it has one"""
+        with self._lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+
+        if session is not None:
+            await session.close()
+
+    def stats(self) -> dict:
+        """
+        Reports how many requests have been made, and how many of them
+        opened a new connection versus reusing a pooled one
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+HTTP_CLIENT = HttpClient()
+
+
+class SharedSessionWebClient(AsyncWebClient):
+    """
+    A Slack Web API client that sends its requests through the shared session for
+    whichever event loop it's called from, rather than opening a session per request.
+    """
+
+    def __init__(self, *args, http_client: HttpClient = HTTP_CLIENT, **kwargs):
+        self._http_client = http_client
+        super().__init__(*args, **kwargs)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session for the running event loop"""
+        return self._http_client.session()
+
+    @session.setter
+    def session(self, session):
+        # The session is always the shared one, so there's nothing to set
+        del session
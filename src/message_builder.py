@@ -4,26 +4,51 @@ the bot doesn't exceed any of Slack's limitations of the number of blocks (50) o
 the length of text (4000 characters) that a single message can contain.
 """
 
+import bisect
 import datetime
-import math
+import hashlib
+import json
+import os
+from collections.abc import AsyncIterator, Iterable
 
 from event import Event
+from render_cache import RENDER_CACHE
 
 # This is lower than the actual limit to provide headroom
 MAX_MESSAGE_CHARACTER_LENGTH = 3000
+# Slack won't accept a message with more blocks than this
+MAX_MESSAGE_BLOCKS = 50
+# Every header is made up of a header block and a divider
+HEADER_BLOCK_COUNT = 2
 # Approximate character length needed to accommodate post headers
 # ex: HackGreenville Events for the week of September 10 - 10 of 10
 HEADER_BUFFER_LENGTH = 61
+# Share of a message's character and block budgets that is filled when a week's events
+# are packed afresh. The rest is left free so that an event added later can join the
+# message it belongs in without pushing events into every message after it.
+PACK_FILL = 0.8
+# How long each week's set of messages covers
+WEEK_LENGTH = datetime.timedelta(days=7)
+# Bump this whenever the way events are rendered or chunked changes
+# so that every week's digest changes and its messages get rebuilt
+RENDER_VERSION = 3
+
+
+def build_header_text(week_start: datetime.datetime, index: int, total: int) -> str:
+    """
+    Return the text of a header
+    """
+    return (
+        f"HackGreenville Events for the week of {week_start.strftime('%B %-d')}"
+        f" - {index} of {total}\n\n===\n\n"
+    )
 
 
 async def build_header(week_start: datetime.datetime, index: int, total: int) -> dict:
     """
     Return a header for an image
     """
-    text = (
-        f"HackGreenville Events for the week of {week_start.strftime('%B %-d')}"
-        f" - {index} of {total}\n\n===\n\n"
-    )
+    text = build_header_text(week_start, index, total)
 
     return {
         "blocks": [
@@ -44,6 +69,156 @@ async def build_header(week_start: datetime.datetime, index: int, total: int) ->
     }
 
 
+async def parse_events(events_data: AsyncIterator[dict]) -> AsyncIterator[Event]:
+    """Parses each event as it is decoded from the feed"""
+    async for event_data in events_data:
+        yield Event.from_event_json(event_data)
+
+
+async def filter_events(
+    events: AsyncIterator[Event],
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+) -> AsyncIterator[Event]:
+    """Passes along only the events that take place between start and end, inclusive"""
+    async for event in events:
+        if (start is None or event.time >= start) and (
+            end is None or event.time <= end
+        ):
+            yield event
+
+
+async def render_event_block(event: Event) -> dict | None:
+    """
+    Returns the uuid, blocks (content and divider), text, and text length of an event
+
+    Events that have been rendered before are served from the render cache.
+    The result is shared with the cache, so it must not be modified.
+    """
+    # ignore event if it has a non-supported status
+    if event.status not in ["cancelled", "upcoming", "past"]:
+        print(f"Couldn't parse event {event.uuid} " f"with status: {event.status}")
+        return None
+
+    cache_key = (
+        event.uuid,
+        event.get_content_hash(),
+        os.environ.get("TZ", ""),
+        RENDER_VERSION,
+    )
+    rendered = RENDER_CACHE.get(cache_key)
+
+    if rendered is None:
+        text = f"{event.generate_text()}\n\n"
+
+        rendered = {
+            "uuid": event.uuid,
+            "blocks": event.generate_blocks() + [{"type": "divider"}],
+            "text": text,
+            "text_length": len(text),
+        }
+
+        RENDER_CACHE.put(cache_key, rendered)
+
+    return rendered
+
+
+async def render_events(events: Iterable[Event]) -> AsyncIterator[dict]:
+    """Renders each event, skipping any that can't be rendered"""
+    for event in events:
+        rendered = await render_event_block(event)
+
+        if rendered:
+            yield rendered
+
+
+class EventTimeline:
+    """
+    The events in the feed, decoded once and sorted by time so that the events
+    within any window of time can be sliced out with a binary search.
+    """
+
+    def __init__(self, events: list):
+        self.events = sorted(events, key=lambda event: event.time)
+        self.times = [event.time for event in self.events]
+
+    @classmethod
+    async def from_response(
+        cls,
+        resp,
+        start: datetime.datetime | None = None,
+        end: datetime.datetime | None = None,
+    ):
+        """
+        Parses the events in the feed that take place between start and end.
+
+        Events are decoded from the feed one at a time and dropped right away if they
+        fall outside the window, so only the events within it are ever kept around.
+        """
+        return cls(
+            [
+                event
+                async for event in filter_events(
+                    parse_events(resp.events()), start, end
+                )
+            ]
+        )
+
+    def between(self, start: datetime.datetime, end: datetime.datetime) -> list:
+        """Returns the events that take place between start and end, inclusive"""
+        return self.events[
+            bisect.bisect_left(self.times, start) : bisect.bisect_right(self.times, end)
+        ]
+
+    def by_week(self, week_starts: list) -> dict:
+        """
+        Buckets the events into the weeks starting at each of week_starts, which must be
+        in order, with a single pass over the events.
+
+        Like between, each week includes both its start and its end, so an event right
+        on the boundary between two weeks lands in both of them.
+        """
+        buckets = {week_start: [] for week_start in week_starts}
+
+        if not week_starts:
+            return buckets
+
+        week_ends = [week_start + WEEK_LENGTH for week_start in week_starts]
+        idx = 0
+
+        for event in self.events[bisect.bisect_left(self.times, week_starts[0]) :]:
+            while idx < len(week_starts) and event.time > week_ends[idx]:
+                idx += 1
+
+            if idx == len(week_starts):
+                break
+
+            for week_idx in range(idx, min(idx + 2, len(week_starts))):
+                if week_starts[week_idx] <= event.time <= week_ends[week_idx]:
+                    buckets[week_starts[week_idx]].append(event)
+
+        return buckets
+
+
+async def digest_events(events: list, week_start: datetime.datetime) -> str:
+    """
+    Returns a digest of everything that goes into the messages for a week's events.
+
+    If the digest hasn't changed since the messages were last posted then the messages
+    wouldn't change either, so there's no need to rebuild them.
+    """
+    return hashlib.sha256(
+        json.dumps(
+            [
+                RENDER_VERSION,
+                os.environ.get("TZ"),
+                week_start.isoformat(),
+                [event.get_content_hash() for event in events],
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
 async def build_single_event_block(
     event_data, week_start: datetime.datetime, week_end: datetime.datetime
 ) -> dict | None:
@@ -54,20 +229,23 @@ async def build_single_event_block(
 
     # ignore event if it's not in the current week
     if event.time < week_start or event.time > week_end:
-        return
+        return None
 
-    # ignore event if it has a non-supported status
-    if event.status not in ["cancelled", "upcoming", "past"]:
-        print(f"Couldn't parse event {event.uuid} " f"with status: {event.status}")
-        return
+    return await render_event_block(event)
 
-    text = f"{event.generate_text()}\n\n"
 
-    return {
-        "blocks": event.generate_blocks() + [{"type": "divider"}],
-        "text": text,
-        "text_length": len(text),
-    }
+async def build_timeline_event_blocks(
+    timeline: EventTimeline, week_start: datetime.datetime, week_end: datetime.datetime
+) -> list:
+    """
+    Build out all of the blocks and text for the events in the timeline during the week
+
+    Strips out any blanks before returning
+    """
+    return [
+        rendered
+        async for rendered in render_events(timeline.between(week_start, week_end))
+    ]
 
 
 async def build_event_blocks(resp, week_start, week_end) -> list:
@@ -76,67 +254,153 @@ async def build_event_blocks(resp, week_start, week_end) -> list:
 
     Strips out any blanks before returning
     """
-    return list(
-        filter(
-            bool,
-            [
-                await build_single_event_block(event, week_start, week_end)
-                for event in await resp.json()
-            ],
-        )
+    return await build_timeline_event_blocks(
+        await EventTimeline.from_response(resp, week_start, week_end),
+        week_start,
+        week_end,
     )
 
 
-async def total_messages_needed(event_blocks: list) -> int:
+def pack_events(
+    event_blocks: list, header_length: int = HEADER_BUFFER_LENGTH, fill: float = 1.0
+) -> list:
     """
-    Determines the total number of posts that will be needed to cover a week's events.
+    Splits the events, in order, into groups that each fit within a single message
+    alongside a header of the given length.
 
-    Will always be at least 1.
+    Each group is filled for as long as the next event fits within the given share of
+    both the character and the block budgets, which gives the fewest groups possible
+    for events that have to stay in order. An event too big to fit in any message is
+    given one to itself.
     """
-    messages_needed = math.ceil(
-        sum(event["text_length"] for event in event_blocks)
-        / (MAX_MESSAGE_CHARACTER_LENGTH - HEADER_BUFFER_LENGTH)
-    )
+    character_budget = MAX_MESSAGE_CHARACTER_LENGTH * fill
+    block_budget = MAX_MESSAGE_BLOCKS * fill
+    groups = [[]]
+    text_length = header_length
+    block_count = HEADER_BLOCK_COUNT
+
+    for event in event_blocks:
+        event_block_count = len(event.get("blocks", []))
+
+        if groups[-1] and (
+            event["text_length"] + text_length >= character_budget
+            or event_block_count + block_count > block_budget
+        ):
+            groups.append([])
+            text_length = header_length
+            block_count = HEADER_BLOCK_COUNT
 
-    # Ensure total count is at least 1 if we're going to post anything
-    if messages_needed == 0:
-        return 1
+        groups[-1].append(event)
+        text_length += event["text_length"]
+        block_count += event_block_count
 
-    return messages_needed
+    return groups
 
 
-async def chunk_messages(event_blocks, week_start) -> list:
+def pack_events_for_week(event_blocks: list, week_start: datetime.datetime) -> list:
     """
-    Chunk up events across messages so that no one message is longer than 4k characters
+    Splits the events into groups that each fit within a single message under one of
+    the week's headers, leaving each message room to grow by packing to PACK_FILL.
+
+    The headers grow as the number of messages does ("9 of 9" to "10 of 10"), so the
+    events are packed against the longest header for the count, and packed again in
+    the rare case that the count gains a digit.
     """
-    messages_needed = await total_messages_needed(event_blocks)
+    total = 1
 
-    messages = []
+    while True:
+        groups = pack_events(
+            event_blocks, len(build_header_text(week_start, total, total)), PACK_FILL
+        )
+
+        if len(str(len(groups))) <= len(str(total)):
+            return groups
+
+        total = len(groups)
 
-    initial_header = await build_header(week_start, 1, messages_needed)
 
-    blocks = initial_header["blocks"]
-    text = initial_header["text"]
+def stable_pack_events(event_blocks: list, layout: list, header_length: int) -> list:
+    """
+    Splits the events, in order, into groups that line up with a previous layout of
+    the week's messages, given as the uuids of the events in each message.
+
+    Events stay in the message they were in before, and new events join the message
+    of the event before them. Messages may grow into the room that packing them afresh
+    leaves free, and only one that has outgrown Slack's limits pushes its last events
+    into the next one, so a change only ripples as far as it has to. Returns None if
+    the events no longer fit into the same number of messages, or if any message would
+    be left without events, since it would be posted as nothing but a header.
+    """
+    anchors = {uuid: index for index, uuids in enumerate(layout) for uuid in uuids}
+    groups = [[] for _ in layout]
+    anchor = 0
 
     for event in event_blocks:
-        # Event can be safely added to existing message
-        if event["text_length"] + len(text) < MAX_MESSAGE_CHARACTER_LENGTH:
-            blocks += event["blocks"]
-            text += event["text"]
-            continue
+        anchor = max(anchor, anchors.get(event.get("uuid"), anchor))
+        groups[anchor].append(event)
+
+    for index, group in enumerate(groups):
+        while len(pack_events(group, header_length)) > 1:
+            if index == len(groups) - 1:
+                return None
+
+            groups[index + 1].insert(0, group.pop())
+
+    if not all(groups):
+        return None
+
+    return groups
+
+
+async def total_messages_needed(event_blocks: list) -> int:
+    """
+    Determines the total number of posts that will be needed to cover a week's events.
+
+    Will always be at least 1.
+    """
+    return len(pack_events(event_blocks, fill=PACK_FILL))
 
-        # Save message and then start a new one
-        messages += [{"blocks": blocks, "text": text}]
 
-        new_header = await build_header(week_start, len(messages) + 1, messages_needed)
+async def chunk_messages(event_blocks, week_start, layout: list | None = None) -> list:
+    """
+    Chunk up events across messages so that no one message is longer than 4k characters
+    or has more than 50 blocks
 
-        blocks = new_header["blocks"]
-        text = new_header["text"]
+    If the layout of the week's messages from when they were last posted is given, the
+    events are kept in the same messages wherever they still fit so that a change to one
+    event only changes the message it's in. Otherwise, or if the events have outgrown
+    that many messages or would leave one empty, they're packed afresh.
+    """
+    groups = None
 
-        blocks += event["blocks"]
-        text += event["text"]
+    if layout:
+        groups = stable_pack_events(
+            event_blocks,
+            layout,
+            len(build_header_text(week_start, len(layout), len(layout))),
+        )
+
+    if groups is None:
+        groups = pack_events_for_week(event_blocks, week_start)
+
+    messages = []
 
-    # Add whatever is left as a new message
-    messages += [{"blocks": blocks, "text": text}]
+    for index, group in enumerate(groups, start=1):
+        header = await build_header(week_start, index, len(groups))
+
+        blocks = header["blocks"]
+        text = header["text"]
+
+        for event in group:
+            blocks += event["blocks"]
+            text += event["text"]
+
+        messages += [
+            {
+                "blocks": blocks,
+                "text": text,
+                "event_uuids": [event.get("uuid") for event in group],
+            }
+        ]
 
     return messages
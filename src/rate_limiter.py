@@ -0,0 +1,226 @@
+"""
+Shapes the bot's outbound traffic to Slack's Web API so that it stays within Slack's
+rate limits instead of being throttled.
+
+Every method belongs to a rate limit tier that is shared across the whole workspace,
+and chat.postMessage is additionally limited to roughly one message per second for each
+channel. Calls are held back until a token is available in each bucket that applies
+to them, and any HTTP 429 responses that slip through are retried after honoring the
+Retry-After header that Slack sends back.
+
+See https://api.slack.com/docs/rate-limits
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+
+from slack_sdk.errors import SlackApiError
+
+# Requests per minute that Slack allows for each of its rate limit tiers
+TIER_REQUESTS_PER_MINUTE = {1: 1, 2: 20, 3: 50, 4: 100}
+
+# The rate limit tier of each Web API method the bot uses.
+# chat.postMessage is absent since it is limited per channel rather than by tier.
+METHOD_TIERS = {"chat.update": 3, "users.info": 4, "users.list": 2}
+
+# Methods which are also limited by the channel they are writing to
+CHANNEL_LIMITED_METHODS = {"chat.postMessage", "chat.update"}
+
+# Messages per second that may be sent to a single channel
+CHANNEL_MESSAGES_PER_SECOND = 1
+
+# Seconds worth of requests that a tier is allowed to burst through at once
+TIER_BURST_SECONDS = 10
+
+# How many times a throttled request is retried before giving up
+MAX_RETRIES = int(os.environ.get("SLACK_MAX_RETRIES", "5"))
+
+# Seconds to back off for whenever Slack doesn't send a Retry-After header.
+# This doubles with every attempt.
+BACKOFF_BASE_SECONDS = 1.0
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket.
+
+    Tokens are handed out as reservations rather than by blocking so that the bucket
+    can be shared between the different event loops that the bot runs.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket and returns the number of seconds
+        the caller needs to wait before it is allowed to use it.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0.0
+
+            return -self._tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Drains the bucket so that no tokens become available for the given seconds."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def get_retry_after(error: SlackApiError) -> float | None:
+    """Returns the number of seconds Slack has asked us to wait, if it told us."""
+    for header, value in (getattr(error.response, "headers", None) or {}).items():
+        if header.lower() == "retry-after":
+            try:
+                return float(value)
+            except ValueError:
+                return None
+
+    return None
+
+
+class SlackRateLimiter:
+    """Schedules calls to Slack's Web API according to Slack's rate limits."""
+
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        backoff_base_seconds: float = BACKOFF_BASE_SECONDS,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self._tier_buckets = {
+            tier: TokenBucket(
+                per_minute / 60, max(1.0, per_minute / 60 * TIER_BURST_SECONDS)
+            )
+            for tier, per_minute in TIER_REQUESTS_PER_MINUTE.items()
+        }
+        self._channel_buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "queue_depth": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "throttled": 0,
+        }
+
+    def _get_buckets(self, method: str, channel: str | None) -> list:
+        buckets = []
+
+        if method in METHOD_TIERS:
+            buckets.append(self._tier_buckets[METHOD_TIERS[method]])
+
+        if channel is not None and method in CHANNEL_LIMITED_METHODS:
+            with self._lock:
+                if channel not in self._channel_buckets:
+                    self._channel_buckets[channel] = TokenBucket(
+                        CHANNEL_MESSAGES_PER_SECOND, 1
+                    )
+
+                buckets.append(self._channel_buckets[channel])
+
+        return buckets
+
+    async def _acquire(self, buckets: list) -> None:
+        wait = max((bucket.reserve() for bucket in buckets), default=0.0)
+
+        if wait <= 0:
+            return
+
+        with self._lock:
+            self._stats["queue_depth"] += 1
+            self._stats["wait_seconds"] += wait
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            with self._lock:
+                self._stats["queue_depth"] -= 1
+
+    def _get_backoff(self, error: SlackApiError, attempt: int) -> float:
+        retry_after = get_retry_after(error)
+
+        if retry_after is None:
+            retry_after = self.backoff_base_seconds * 2**attempt
+
+        # Jitter keeps every throttled caller from retrying at the exact same moment
+        return retry_after + random.uniform(0, retry_after / 2)
+
+    async def call(self, method: str, func: Callable[..., Awaitable], **kwargs):
+        """
+        Invokes a Slack Web API method once the rate limits that apply to it allow.
+
+        Throttled requests are retried up to max_retries times before the
+        SlackApiError is raised to the caller.
+        """
+        buckets = self._get_buckets(method, kwargs.get("channel"))
+
+        with self._lock:
+            self._stats["calls"] += 1
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(buckets)
+
+            try:
+                return await func(**kwargs)
+            except SlackApiError as error:
+                if (
+                    getattr(error.response, "status_code", None) != 429
+                    or attempt == self.max_retries
+                ):
+                    raise
+
+                backoff = self._get_backoff(error, attempt)
+
+                with self._lock:
+                    self._stats["throttled"] += 1
+
+                logging.warning(
+                    "Slack throttled a call to %s. Retrying in %.2f seconds.",
+                    method,
+                    backoff,
+                )
+
+                for bucket in buckets:
+                    bucket.pause(backoff)
+
+                if not buckets:
+                    await asyncio.sleep(backoff)
+
+        # Unreachable since the final attempt always returns or raises
+        return None
+
+    def stats(self) -> dict:
+        """
+        Reports how many calls have been made, how many are currently waiting on
+        a rate limit, how long they have waited in total, and how often Slack
+        throttled us regardless.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+SLACK_RATE_LIMITER = SlackRateLimiter()
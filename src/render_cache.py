@@ -0,0 +1,121 @@
+"""
+A bounded, least recently used cache of rendered events.
+
+Most events come back from the API unchanged from one hour to the next, so the
+blocks and text rendered for them can be reused rather than rendered again. Entries
+are keyed by the event's uuid and content hash, the timezone, and the render version,
+so any change to what goes into an event's message misses the cache.
+
+The cache can optionally be persisted to the database so that it survives restarts.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import database
+
+# The most rendered events that will be kept around
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "2048"))
+
+# Whether the cache should be saved to and loaded from the database
+RENDER_CACHE_PERSIST = os.environ.get("RENDER_CACHE_PERSIST", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+class RenderCache:
+    """Maps rendered events' keys to their blocks and text"""
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE, persist: bool = False):
+        self.max_size = max_size
+        self.persist = persist
+        self._entries = OrderedDict()
+        # Keys that have been added (True) or evicted (False) since the cache was saved
+        self._changed_keys = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: tuple) -> dict | None:
+        """Returns the rendered event for the key, if it has been cached"""
+        with self._lock:
+            rendered = self._entries.get(key)
+
+            if rendered is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+
+            return rendered
+
+    def put(self, key: tuple, rendered: dict) -> None:
+        """Caches a rendered event, evicting the least recently used one if full"""
+        with self._lock:
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+
+            if self.persist:
+                self._changed_keys[key] = True
+
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+                if self.persist:
+                    self._changed_keys[evicted_key] = False
+
+    def clear(self) -> None:
+        """Forgets every cached event"""
+        with self._lock:
+            self._entries.clear()
+            self._changed_keys.clear()
+
+    async def load(self) -> None:
+        """Fills the cache from the database, if the cache is persisted"""
+        if not self.persist or self._loaded:
+            return
+
+        rows = await database.get_rendered_events(self.max_size)
+
+        with self._lock:
+            # Rows come back most recently used first
+            for *key, rendered in reversed(rows):
+                self._entries.setdefault(tuple(key), json.loads(rendered))
+
+            self._loaded = True
+
+    async def save(self) -> None:
+        """Writes any changes to the cache to the database, if the cache is persisted"""
+        if not self.persist:
+            return
+
+        with self._lock:
+            upserts = [
+                [*key, json.dumps(self._entries[key])]
+                for key, cached in self._changed_keys.items()
+                if cached
+            ]
+            deletes = [
+                list(key) for key, cached in self._changed_keys.items() if not cached
+            ]
+            self._changed_keys = {}
+
+        if upserts or deletes:
+            await database.save_rendered_events(upserts, deletes)
+
+    def stats(self) -> dict:
+        """Reports the cache's size along with its hit, miss, and eviction counts"""
+        with self._lock:
+            return {"size": len(self._entries), **self._stats}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+RENDER_CACHE = RenderCache(persist=RENDER_CACHE_PERSIST)
@@ -0,0 +1,161 @@
+"""Deletes the rows of the sqlite database that are older than their retention period"""
+
+import asyncio
+import datetime
+import os
+import time
+
+from database import get_connection, run_in_executor
+
+# Each statement deletes at most one batch of rows that are older than a cutoff
+DELETE_OLD_MESSAGES_SQL = """DELETE FROM messages WHERE id IN (
+        SELECT id FROM messages WHERE posted_at < ? LIMIT ?
+    )"""
+
+DELETE_OLD_COOLDOWNS_SQL = """DELETE FROM cooldowns WHERE id IN (
+        SELECT id FROM cooldowns WHERE expires_at < ? LIMIT ?
+    )"""
+
+DELETE_OLD_WEEK_DIGESTS_SQL = """DELETE FROM week_digests WHERE (week, channel_id) IN (
+        SELECT week, channel_id FROM week_digests WHERE week < ? LIMIT ?
+    )"""
+
+DELETE_OLD_RENDERED_EVENTS_SQL = """DELETE FROM rendered_events WHERE rowid IN (
+        SELECT rowid FROM rendered_events WHERE used_at < ? LIMIT ?
+    )"""
+
+# How to delete old rows from each table, and how its cutoff is stored
+RETENTION_POLICIES = {
+    "messages": (DELETE_OLD_MESSAGES_SQL, datetime.datetime.timestamp),
+    "cooldowns": (DELETE_OLD_COOLDOWNS_SQL, datetime.datetime.isoformat),
+    "week_digests": (DELETE_OLD_WEEK_DIGESTS_SQL, str),
+    "rendered_events": (DELETE_OLD_RENDERED_EVENTS_SQL, datetime.datetime.timestamp),
+}
+
+# Days that rows are kept in each table. Zero or less keeps them forever.
+DB_RETENTION_DAYS = {
+    "messages": int(os.environ.get("DB_MESSAGES_RETENTION_DAYS", "90")),
+    "cooldowns": int(os.environ.get("DB_COOLDOWNS_RETENTION_DAYS", "90")),
+    "week_digests": int(os.environ.get("DB_WEEK_DIGESTS_RETENTION_DAYS", "90")),
+    "rendered_events": int(os.environ.get("DB_RENDERED_EVENTS_RETENTION_DAYS", "30")),
+}
+# The most rows deleted in each transaction
+DB_RETENTION_BATCH_SIZE = int(os.environ.get("DB_RETENTION_BATCH_SIZE", "500"))
+# Seconds to wait between batches so that other writes can get the lock
+DB_RETENTION_PAUSE = float(os.environ.get("DB_RETENTION_PAUSE", "0.05"))
+# Pages to free with an incremental vacuum after deleting, which only has an effect
+# if the database's auto_vacuum mode is INCREMENTAL. Zero skips it.
+DB_RETENTION_VACUUM_PAGES = int(os.environ.get("DB_RETENTION_VACUUM_PAGES", "0"))
+# Whether to let SQLite refresh its query planner statistics after deleting
+DB_RETENTION_OPTIMIZE = os.environ.get("DB_RETENTION_OPTIMIZE", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# When old rows are deleted, as a number of seconds or a cron expression
+DB_RETENTION_SCHEDULE = os.environ.get("DB_RETENTION_SCHEDULE", str(60 * 60 * 24))
+# Up to how many seconds each run of the retention job is randomly delayed by
+DB_RETENTION_JITTER = float(os.environ.get("DB_RETENTION_JITTER", "300"))
+# Seconds that a run of the retention job may take before it counts as failed
+DB_RETENTION_TIMEOUT = float(os.environ.get("DB_RETENTION_TIMEOUT", "3600"))
+
+
+@run_in_executor(write=True)
+def delete_old_rows_batch(table: str, cutoff: datetime.datetime, batch_size: int):
+    """
+    Deletes up to batch_size rows older than the cutoff from a table in one transaction.
+
+    Returns the number of rows deleted and the number of seconds the write lock was held.
+    """
+    query, convert_cutoff = RETENTION_POLICIES[table]
+    started = time.perf_counter()
+
+    for conn in get_connection(commit=True):
+        cur = conn.cursor()
+        cur.execute(query, [convert_cutoff(cutoff), batch_size])
+        deleted = cur.rowcount
+
+    return deleted, time.perf_counter() - started
+
+
+@run_in_executor(write=True)
+def tidy_after_deleting(vacuum_pages: int, optimize: bool) -> float:
+    """
+    Frees pages left behind by deleted rows and refreshes the query planner's statistics.
+
+    Returns the number of seconds it took.
+    """
+    started = time.perf_counter()
+
+    for conn in get_connection():
+        if vacuum_pages > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+
+        if optimize:
+            conn.execute("PRAGMA optimize")
+
+    return time.perf_counter() - started
+
+
+async def delete_old_messages(
+    days_back: int | None = None,
+    batch_size: int = DB_RETENTION_BATCH_SIZE,
+    pause: float = DB_RETENTION_PAUSE,
+) -> dict:
+    """
+    Delete messages, cooldowns, week digests, and rendered events that are older than
+    each table's retention period, or days_back for messages and cooldowns if given.
+
+    Rows are deleted in small batches, each in its own transaction, with a pause in
+    between so that the write lock is never held for long and other writes aren't held
+    up behind the cleanup.
+
+    Returns the number of rows deleted and batches run for each table, along with the
+    total and longest time the write lock was held.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    retention_days = dict(DB_RETENTION_DAYS)
+
+    if days_back is not None:
+        retention_days.update(messages=days_back, cooldowns=days_back)
+
+    stats = {}
+
+    for table, days in retention_days.items():
+        if days <= 0:
+            continue
+
+        cutoff = now - datetime.timedelta(days=days)
+        table_stats = {
+            "deleted": 0,
+            "batches": 0,
+            "lock_seconds": 0,
+            "max_lock_seconds": 0,
+        }
+        stats[table] = table_stats
+
+        while True:
+            deleted, lock_seconds = await delete_old_rows_batch(
+                table, cutoff, batch_size
+            )
+
+            table_stats["deleted"] += deleted
+            table_stats["batches"] += 1
+            table_stats["lock_seconds"] += lock_seconds
+            table_stats["max_lock_seconds"] = max(
+                table_stats["max_lock_seconds"], lock_seconds
+            )
+
+            if deleted < batch_size:
+                break
+
+            await asyncio.sleep(pause)
+
+    if any(table_stats["deleted"] for table_stats in stats.values()) and (
+        DB_RETENTION_VACUUM_PAGES > 0 or DB_RETENTION_OPTIMIZE
+    ):
+        stats["tidy_seconds"] = await tidy_after_deleting(
+            DB_RETENTION_VACUUM_PAGES, DB_RETENTION_OPTIMIZE
+        )
+
+    return stats
@@ -0,0 +1,380 @@
+"""
+Runs the bot's periodic jobs as tasks on the server's event loop.
+
+Every job has a schedule, which is either an interval in seconds or a cron expression,
+and may be given jitter so that its runs don't land on the exact same second every
+time. A job never overlaps with itself since each job's runs happen one after another
+in a single task; any runs it misses while one is taking too long are skipped.
+Runs can be held to a timeout, and whenever one fails the job's restart policy decides
+what happens next:
+
+- "always" carries on with the next scheduled run
+- "backoff" retries with an exponentially growing delay, never waiting longer than the
+  next scheduled run would have
+- "never" stops the job for good
+
+A job that fails too many times in a row is reported as failed so that the health
+check can flag it, and the state of every job can be looked at while the bot runs.
+"""
+
+import asyncio
+import datetime
+import logging
+import random
+import time
+import traceback
+from collections.abc import Awaitable, Callable
+
+# The policies for what a job does after one of its runs fails
+RESTART_POLICIES = ("always", "backoff", "never")
+
+# Seconds to wait before the first retry of a job using the backoff restart policy.
+# This doubles with every failure in a row.
+BACKOFF_BASE_SECONDS = 30.0
+
+# How far ahead to look for the next time that matches a cron expression
+CRON_SEARCH_YEARS = 5
+
+
+class Interval:  # pylint: disable=too-few-public-methods
+    """Runs a job every so many seconds, starting right away"""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("An interval must be a positive number of seconds")
+
+        self.seconds = seconds
+
+    def next_run(self, last_run: datetime.datetime | None, now: datetime.datetime):
+        """Returns when the job should run next"""
+        if last_run is None:
+            return now
+
+        # Keep to the original cadence, skipping past any runs that were missed
+        missed = max((now - last_run).total_seconds() // self.seconds, 0)
+
+        return last_run + datetime.timedelta(seconds=self.seconds * (missed + 1))
+
+    def __repr__(self) -> str:
+        return f"Interval({self.seconds:g})"
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> frozenset:
+    """Expands a single cron field, such as */15 or 1-5 or 0,30, into its values"""
+    values = set()
+
+    for part in field.split(","):
+        range_part, _, step = part.partition("/")
+
+        if range_part == "*":
+            start, end = low, high
+        elif "-" in range_part:
+            start, end = (int(value) for value in range_part.split("-", 1))
+        else:
+            start = end = int(range_part)
+
+            if step:
+                end = high
+
+        if not low <= start <= end <= high:
+            raise ValueError(f"The cron field {field!r} must be within {low}-{high}")
+
+        values.update(range(start, end + 1, int(step) if step else 1))
+
+    return frozenset(values)
+
+
+class Cron:  # pylint: disable=too-few-public-methods
+    """
+    Runs a job whenever the local time matches a standard five field cron expression:
+    minute, hour, day of month, month, and day of week (with Sunday as 0 or 7)
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+
+        if len(fields) != 5:
+            raise ValueError(
+                f"The cron expression {expression!r} must have exactly five fields"
+            )
+
+        self.expression = expression
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        self.weekdays = frozenset(day % 7 for day in _parse_cron_field(fields[4], 0, 7))
+        # Cron matches either day field when both are restricted, and both otherwise
+        self._match_either_day = fields[2] != "*" and fields[4] != "*"
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        day_matches = moment.day in self.days
+        weekday_matches = (moment.weekday() + 1) % 7 in self.weekdays
+
+        if self._match_either_day:
+            return day_matches or weekday_matches
+
+        return day_matches and weekday_matches
+
+    def next_run(self, last_run: datetime.datetime | None, now: datetime.datetime):
+        """Returns the first matching minute after now"""
+        del last_run
+
+        # Search in naive local time so that the UTC offset of now doesn't carry over
+        # to a match on the other side of a daylight saving time change
+        aware = now.tzinfo is not None
+
+        if aware:
+            now = now.astimezone().replace(tzinfo=None)
+
+        moment = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        give_up_at = moment + datetime.timedelta(days=366 * CRON_SEARCH_YEARS)
+
+        while moment < give_up_at:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + datetime.timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                # Naive times are taken to be local, getting that date's UTC offset
+                return moment.astimezone() if aware else moment
+
+        raise ValueError(f"The cron expression {self.expression!r} never matches")
+
+    def __repr__(self) -> str:
+        return f"Cron({self.expression!r})"
+
+
+def parse_schedule(spec: str) -> Interval | Cron:
+    """
+    Reads a schedule from configuration, which is either
+    a number of seconds or a five field cron expression
+    """
+    try:
+        return Interval(float(spec))
+    except ValueError:
+        return Cron(spec)
+
+
+def _isoformat(moment: datetime.datetime | None) -> str | None:
+    return moment.isoformat() if moment else None
+
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """A periodic job, along with what has happened to it so far"""
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable],
+        schedule: Interval | Cron | None = None,
+        jitter: float = 0,
+        timeout: float | None = None,
+        restart: str = "backoff",
+        max_failures: int = 3,
+    ):
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"The restart policy must be one of {RESTART_POLICIES}")
+
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.timeout = timeout
+        self.restart = restart
+        self.max_failures = max_failures
+
+        self.state = "pending"
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.skipped_runs = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_error = None
+        self.next_run = None
+
+    @property
+    def failed(self) -> bool:
+        """Whether the job has stopped for good or keeps failing"""
+        return self.state == "failed" or self.consecutive_failures >= self.max_failures
+
+    def describe(self) -> dict:
+        """Reports the job's configuration and what has happened to it so far"""
+        return {
+            "schedule": repr(self.schedule) if self.schedule else "once",
+            "state": self.state,
+            "failed": self.failed,
+            "runs": self.runs,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "skipped_runs": self.skipped_runs,
+            "last_started": _isoformat(self.last_started),
+            "last_finished": _isoformat(self.last_finished),
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "next_run": _isoformat(self.next_run),
+        }
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now().astimezone()
+
+
+class Scheduler:
+    """Keeps track of the bot's jobs and runs each of them in its own task"""
+
+    def __init__(self):
+        self.jobs = {}
+        self._tasks = {}
+        self._stop_callbacks = []
+
+    @staticmethod
+    def _backoff(job: Job) -> float:
+        return BACKOFF_BASE_SECONDS * 2 ** (job.consecutive_failures - 1)
+
+    @staticmethod
+    async def _run_once(job: Job) -> bool:
+        """Runs a job a single time, recording how it went"""
+        job.state = "running"
+        job.runs += 1
+        job.last_started = _now()
+        started = time.monotonic()
+
+        try:
+            await asyncio.wait_for(job.func(), job.timeout)
+        except Exception as error:  # pylint: disable=broad-except
+            job.failures += 1
+            job.consecutive_failures += 1
+            job.last_error = repr(error)
+
+            if isinstance(error, TimeoutError):
+                logging.error("The %s job timed out after %ss", job.name, job.timeout)
+            else:
+                logging.error(
+                    "The %s job failed:\n%s", job.name, traceback.format_exc()
+                )
+
+            return False
+        else:
+            job.consecutive_failures = 0
+            return True
+        finally:
+            job.last_finished = _now()
+            job.last_duration = time.monotonic() - started
+
+    async def _run_job(self, job: Job) -> None:
+        scheduled_for = job.schedule.next_run(None, _now()) if job.schedule else _now()
+
+        while True:
+            job.next_run = scheduled_for
+            job.state = "scheduled"
+
+            delay = (scheduled_for - _now()).total_seconds()
+            await asyncio.sleep(max(delay, 0) + random.uniform(0, job.jitter))
+
+            succeeded = await self._run_once(job)
+
+            if not succeeded and job.restart == "never":
+                job.state = "failed"
+                job.next_run = None
+                return
+
+            if job.schedule is None:
+                if succeeded:
+                    job.state = "done"
+                    job.next_run = None
+                    return
+
+                scheduled_for = _now() + datetime.timedelta(seconds=self._backoff(job))
+                continue
+
+            now = _now()
+            next_scheduled = job.schedule.next_run(scheduled_for, now)
+
+            # Any runs that should have started while this one was going are skipped
+            if isinstance(job.schedule, Interval):
+                job.skipped_runs += (
+                    round(
+                        (next_scheduled - scheduled_for).total_seconds()
+                        / job.schedule.seconds
+                    )
+                    - 1
+                )
+
+            if not succeeded and job.restart == "backoff":
+                retry_at = now + datetime.timedelta(seconds=self._backoff(job))
+                next_scheduled = min(retry_at, next_scheduled)
+
+            scheduled_for = next_scheduled
+
+    def _start_job(self, job: Job) -> None:
+        self._tasks[job.name] = asyncio.get_running_loop().create_task(
+            self._run_job(job), name=f"job_{job.name}"
+        )
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], **kwargs) -> Job:
+        """
+        Registers a job, which starts running once the scheduler starts.
+        Jobs without a schedule only run until they succeed once.
+        """
+        if name in self.jobs:
+            raise ValueError(f"A job named {name!r} has already been added")
+
+        job = Job(name, func, **kwargs)
+        self.jobs[name] = job
+
+        if self._tasks:
+            self._start_job(job)
+
+        return job
+
+    async def start(self) -> None:
+        """Starts running every job on the current event loop"""
+        for job in self.jobs.values():
+            if job.name not in self._tasks:
+                self._start_job(job)
+
+    async def stop(self) -> None:
+        """Cancels every job and waits for them to wind down"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for callback in self._stop_callbacks:
+            await callback()
+
+        for job in self.jobs.values():
+            if job.state not in ("done", "failed"):
+                job.state = "stopped"
+                job.next_run = None
+
+    def on_stop(self, callback: Callable[[], Awaitable]) -> None:
+        """
+        Registers a callback to be awaited once the jobs have been cancelled, for
+        winding down any work they started that outlives them
+        """
+        self._stop_callbacks.append(callback)
+
+    def describe(self) -> dict:
+        """Reports on every job"""
+        return {name: job.describe() for name, job in self.jobs.items()}
+
+    def failed_jobs(self) -> list:
+        """Returns the names of the jobs that have stopped for good or keep failing"""
+        return [name for name, job in self.jobs.items() if job.failed]
+
+
+SCHEDULER = Scheduler()
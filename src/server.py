@@ -4,43 +4,49 @@
   Visit the /docs route for more information on the routes contained within.
 """
 
-import asyncio
-import datetime
 import logging
 import os
-import re
-import sys
 import threading
-from collections.abc import Awaitable, Callable
+import urllib.parse
 from typing import Union
 
 import uvicorn
 from fastapi import HTTPException, Request
 from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+# Importing bot registers its Slack handlers and periodic jobs
+import bot  # pylint: disable=unused-import
 import database
-from auth import validate_slack_command_source
-from bot import periodically_check_api, periodically_delete_old_messages
+from admin_cache import ADMIN_CACHE_WARMUP
+from auth import validate_slack_command_source, warm_up_admin_cache
 from config import API, SLACK_APP_HANDLER
+from cooldowns import COOLDOWNS
+from scheduler import SCHEDULER
 
+# The fields of a slash command's form encoded body that the middleware needs
+SLASH_COMMAND_FIELDS = {b"command", b"team_domain"}
 
-async def identify_slack_team_domain(payload: bytes) -> Union[str, None]:
-    """Extracts the value of 'team_domain=' from the request body sent by Slack."""
-    decoded_payload = payload.decode("utf-8")
 
-    match = re.search(r"team_domain=(.+?(?=&))", decoded_payload)
+def read_slash_command_fields(payload: bytes) -> dict:
+    """
+    Pulls the command and team_domain out of the form encoded body that Slack sends
+    for a slash command, without decoding the rest of the body.
 
-    if match is None:
-        return logging.error("The team_domain could not be extracted from the payload.")
+    Field names can't contain an escaped "&" or "=", so splitting on them is safe.
+    """
+    fields = {}
 
-    return match.groups()[0]
+    for pair in payload.split(b"&"):
+        name, _, value = pair.partition(b"=")
 
+        if name in SLASH_COMMAND_FIELDS:
+            fields[name.decode()] = urllib.parse.unquote_plus(value.decode("utf-8"))
 
-async def check_api_being_requested(path: str, payload: bytes) -> bool:
-    """Determines if a user is attempting to execute the /check_api command."""
-    decoded_payload = payload.decode("utf-8")
+            if len(fields) == len(SLASH_COMMAND_FIELDS):
+                break
 
-    return path == "/slack/events" and "command=%2Fcheck_api" in decoded_payload
+    return fields
 
 
 async def check_api_on_cooldown(team_domain: Union[str, None]) -> bool:
@@ -60,50 +66,109 @@ async def check_api_on_cooldown(team_domain: Union[str, None]) -> bool:
         logging.warning("team_domain was None in check_api_on_cooldown")
         return True
 
-    expiry = await database.get_cooldown_expiry_time(team_domain, "check_api")
-
-    if expiry is None:
-        return False
-
-    if datetime.datetime.now(datetime.timezone.utc) > datetime.datetime.fromisoformat(
-        expiry
-    ):
-        return False
-
-    return True
+    return await COOLDOWNS.is_on_cooldown(team_domain, "check_api")
 
 
 async def update_check_api_cooldown(team_domain: str | None) -> None:
     """
     Creates a new cooldown record for an accessor to the check_api method
     after they've been permitted access.
+
+    The cooldown takes effect right away, and is saved to the database in the background.
     """
     if team_domain is None:
         return
 
-    await database.create_cooldown(team_domain, "check_api", 15)
+    COOLDOWNS.start_cooldown(team_domain, "check_api", 15)
+
+
+async def read_body(receive: Receive) -> bytes:
+    """Reads a request's whole body from its ASGI messages"""
+    chunks = []
+
+    while True:
+        message = await receive()
+
+        if message["type"] != "http.request":
+            break
+
+        chunks.append(message.get("body", b""))
+
+        if not message.get("more_body", False):
+            break
+
+    return b"".join(chunks)
+
+
+def replay_body(body: bytes, receive: Receive) -> Receive:
+    """
+    Returns an ASGI receive callable that hands back a body that has already been read,
+    and then carries on with the original callable for anything after it.
+    """
+    body_sent = False
+
+    async def receive_replayed_body() -> Message:
+        nonlocal body_sent
+
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return await receive()
+
+    return receive_replayed_body
+
+
+class CheckApiRateLimitMiddleware:
+    """
+    Looks to see if /check_api has been run recently, and returns an error if so.
+
+    This is a plain ASGI middleware rather than an http middleware so that responses
+    are sent straight through instead of being relayed by an extra task. Requests to
+    anywhere but /slack/events are passed along untouched, body and all.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Commands only arrive at /slack/events, so no other request's body is read
+        if scope["type"] != "http" or scope["path"] != "/slack/events":
+            await self.app(scope, receive, send)
+            return
 
+        req_body = await read_body(receive)
+        # Shared with validate_slack_command_source so it doesn't read the body again
+        scope.setdefault("state", {})["body"] = req_body
 
-@API.middleware("http")
-async def rate_limit_check_api(
-    req: Request, call_next: Callable[[Request], Awaitable[None]]
-):
-    """Looks to see if /check_api has been run recently, and returns an error if so."""
-    req_body = await req.body()
+        fields = read_slash_command_fields(req_body)
 
-    if await check_api_being_requested(req.scope["path"], req_body):
-        team_domain = await identify_slack_team_domain(req_body)
-        if await check_api_on_cooldown(team_domain):
-            return PlainTextResponse(
-                (
-                    "This command has been run recently and is on a cooldown period. "
-                    "Please try again in a little while!"
+        if fields.get("command") == "/check_api":
+            team_domain = fields.get("team_domain")
+
+            if team_domain is None:
+                logging.error(
+                    "The team_domain could not be extracted from the payload."
                 )
-            )
 
-        await update_check_api_cooldown(team_domain)
+            if await check_api_on_cooldown(team_domain):
+                response = PlainTextResponse(
+                    (
+                        "This command has been run recently and is on a cooldown "
+                        "period. Please try again in a little while!"
+                    )
+                )
+                await response(scope, receive, send)
+                return
+
+            await update_check_api_cooldown(team_domain)
+
+        await self.app(scope, replay_body(req_body, receive), send)
+
 
-    return await call_next(req)
+API.add_middleware(CheckApiRateLimitMiddleware)
 
 
 @API.post("/slack/events")
@@ -119,9 +184,9 @@ async def health_check(req: Request):
     """
     Route used to test if the server is still online.
 
-    Returns a 500 response if one or more threads are found to be dead. Enough of these
-    in a row will cause the docker container to be placed into an unhealthy state and soon
-    restarted.
+    Returns a 500 response if one or more threads are found to be dead, or if one of the
+    periodic jobs has stopped or keeps failing. Enough of these in a row will cause the
+    docker container to be placed into an unhealthy state and soon restarted.
 
     Returns a 200 response otherwise.
     """
@@ -134,39 +199,39 @@ async def health_check(req: Request):
                 detail=f"The {thd.name} thread has died. This container will soon restart.",
             )
 
+    failed_jobs = SCHEDULER.failed_jobs()
+
+    if failed_jobs:
+        raise HTTPException(
+            status_code=500,
+            detail=f"The {failed_jobs[0]} job has failed. This container will soon restart.",
+        )
+
     return {"detail": "Everything is lookin' good!"}
 
 
+@API.get("/jobs", tags=["Utility"])
+async def list_jobs(req: Request):
+    """Reports the schedule and state of every periodic job."""
+    del req
+
+    return SCHEDULER.describe()
+
+
+if ADMIN_CACHE_WARMUP:
+    # cache every user's admin status so admin-only commands rarely wait on Slack
+    SCHEDULER.add_job("admin_cache_warmup", warm_up_admin_cache)
+
+# load cooldowns up front so the first request doesn't have to wait on the database
+SCHEDULER.add_job("cooldowns_load", COOLDOWNS.load)
+
+
 if __name__ == "__main__":
     # create database tables if they don't exist
     database.create_tables()
     print("Created database tables!")
 
-    # once a day, purge rows older than 90 days
-    thread = threading.Thread(
-        target=asyncio.run,
-        args=(periodically_delete_old_messages(),),
-        name="periodic_message_deletion",
-    )
-    try:
-        thread.daemon = True
-        thread.start()
-    except (KeyboardInterrupt, SystemExit):
-        thread.join(timeout=60)
-        sys.exit()
-
-    # start checking api every hour in background thread
-    thread = threading.Thread(
-        target=asyncio.run, args=(periodically_check_api(),), name="periodic_api_check"
-    )
-    try:
-        thread.daemon = True
-        thread.start()
-    except (KeyboardInterrupt, SystemExit):
-        thread.join(timeout=60)
-        sys.exit()
-
-    # Default port is 3000
+    # Default port is 3000. The periodic jobs run on the server's event loop.
     uvicorn.run(
         API, port=int(int(os.environ.get("PORT", "3000").strip("\"'"))), host="0.0.0.0"
     )
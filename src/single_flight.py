@@ -0,0 +1,122 @@
+"""
+Makes sure only one run of a job happens at a time, however many times it's asked for.
+
+Asking for a run while one is already going doesn't start another. Instead a single
+follow-up run is queued to start once the current one finishes, and everyone who asks
+in the meantime waits on that same follow-up. However big a burst of requests is, at
+most two runs come out of it: the one in progress and the one queued after it.
+
+Runs are tracked with thread-safe futures, so requests can come from any thread or
+event loop. The runs themselves happen on the loop of whoever started the first one.
+Since nobody waiting on a run can cancel it for everyone else, a run may be given a
+timeout, and whatever is in progress can be cancelled outright when the bot shuts down.
+"""
+
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+
+
+class SingleFlight:  # pylint: disable=too-many-instance-attributes
+    """Coordinates the runs of a job so that they never overlap"""
+
+    def __init__(self, job: Callable[..., Awaitable], timeout: float | None = None):
+        self.job = job
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._running = False
+        # The follow-up run, and whether any request for it asked it to be forced
+        self._queued = None
+        self._queued_force = False
+        self._driver = None
+        self._stats = {"runs": 0, "queued": 0, "attached": 0}
+
+    async def _drive(self, run: Future, force: bool) -> None:
+        """Runs the job, then the follow-up run for as long as one keeps being queued"""
+        try:
+            while True:
+                with self._lock:
+                    self._stats["runs"] += 1
+
+                try:
+                    run.set_result(
+                        await asyncio.wait_for(self.job(force=force), self.timeout)
+                    )
+                except Exception as error:  # pylint: disable=broad-except
+                    run.set_exception(error)
+
+                with self._lock:
+                    if self._queued is None:
+                        self._running = False
+                        self._driver = None
+                        return
+
+                    run, force = self._queued, self._queued_force
+                    self._queued = None
+        except BaseException:
+            # The loop running the job is going away, so nobody is left to run it
+            with self._lock:
+                abandoned = [run, self._queued]
+                self._queued = None
+                self._running = False
+                self._driver = None
+
+            for abandoned_run in abandoned:
+                if abandoned_run is not None:
+                    abandoned_run.cancel()
+
+            raise
+
+    async def run(self, force: bool = False):
+        """
+        Runs the job, or waits for the next run to finish if one is already in progress.
+        Returns whatever the run that was waited on returned.
+        """
+        with self._lock:
+            if not self._running:
+                self._running = True
+                run = Future()
+                start = True
+            else:
+                if self._queued is None:
+                    self._queued = Future()
+                    self._queued_force = False
+                    self._stats["queued"] += 1
+                else:
+                    self._stats["attached"] += 1
+
+                self._queued_force = self._queued_force or force
+                run = self._queued
+                start = False
+
+        if start:
+            self._driver = asyncio.get_running_loop().create_task(
+                self._drive(run, force)
+            )
+
+        # Shielded so that a caller who gives up waiting doesn't cancel the run for everyone
+        return await asyncio.shield(asyncio.wrap_future(run))
+
+    async def cancel(self) -> None:
+        """
+        Cancels the run in progress, along with the follow-up queued after it,
+        and waits for it to wind down if it is running on this event loop
+        """
+        with self._lock:
+            driver = self._driver
+
+        if driver is None:
+            return
+
+        if driver.get_loop() is not asyncio.get_running_loop():
+            driver.get_loop().call_soon_threadsafe(driver.cancel)
+            return
+
+        driver.cancel()
+        await asyncio.gather(driver, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Reports how many runs happened and how many requests were folded into them"""
+        with self._lock:
+            return dict(self._stats)
@@ -1,5 +1,4 @@
 """Pytest Fixtures"""
-import json
 import pathlib
 from threading import Thread
 
@@ -11,6 +10,7 @@ import bot
 import config
 import database
 import server
+from events_api import FeedResponse
 
 
 @pytest.fixture
@@ -37,13 +37,16 @@ def db_cleanup():
     for conn in database.get_connection():
         cur = conn.cursor()
 
-        cur.executescript(
+        tables = cur.execute(
             """
-            SELECT 'DELETE FROM ' || name
+            SELECT name
             FROM sqlite_master
-            WHERE type = 'table';
+            WHERE type = 'table' AND name != 'schema_version';
             """
-        )
+        ).fetchall()
+
+        for (table,) in tables:
+            cur.execute(f"DELETE FROM {table}")
 
         conn.commit()
 
@@ -57,8 +60,8 @@ def event_api_response_data():
     """
     data_file = pathlib.Path("tests/data/events_api_response.json")
 
-    with open(data_file, "r", encoding="utf-8") as open_file:
-        return mocks.mock_response.MockResponse(json=json.loads(open_file.read()))
+    with open(data_file, "rb") as open_file:
+        return FeedResponse.from_body(open_file.read())
 
 
 @pytest.fixture
@@ -29,6 +29,23 @@ class Client:
             "user": {"id": user, "name": "Tester", "is_admin": "admin" in user.lower()},
         }
 
+    async def users_list(self, cursor=None, limit=0):
+        """Simulates listing the users in a workspace, two pages long"""
+        del limit
+
+        if cursor is None:
+            return {
+                "ok": True,
+                "members": [{"id": "listed_admin", "is_admin": True}],
+                "response_metadata": {"next_cursor": "page_2"},
+            }
+
+        return {
+            "ok": True,
+            "members": [{"id": "listed_user", "is_admin": False}],
+            "response_metadata": {"next_cursor": ""},
+        }
+
 
 class AsyncApp:
     """Simulates slack_bolt.async_app's AsyncApp"""
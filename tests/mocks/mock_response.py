@@ -2,21 +2,77 @@
 Utility classes and functions for mocking responses from external services.
 """
 
+import json as jsonlib
+
+
+class MockStreamReader:
+    """
+    A pared-down mock aiohttp stream reader for a response's content.
+    """
+
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def iter_chunked(self, size):
+        """Yields the body in chunks of the given size"""
+        for start in range(0, len(self._body), size):
+            yield self._body[start : start + size]
+
 
 class MockResponse:
     """
     A pared-down mock aiohttp response.
     """
 
-    def __init__(self, json):
+    def __init__(self, json=None, status=200, headers=None, body=None):
         self._json = json
+        self.status = status
+        self.headers = headers or {}
+        self._body = body
+
+    @property
+    def content(self):
+        """Returns a stream of the body that was fed in"""
+        if self._body is not None:
+            return MockStreamReader(self._body)
+
+        return MockStreamReader(jsonlib.dumps(self._json).encode("utf-8"))
 
     async def json(self):
         """Returns whatever JSON was fed in"""
         return self._json
 
+    async def read(self):
+        """Returns the body that was fed in, or the JSON that was fed in as bytes"""
+        if self._body is not None:
+            return self._body
+
+        return jsonlib.dumps(self._json).encode("utf-8")
+
+    def raise_for_status(self):
+        """Raises an error for any failing status codes"""
+        if self.status >= 400:
+            raise RuntimeError(f"The request failed with a {self.status} status")
+
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
+
+
+class MockSession:
+    """
+    A pared-down mock aiohttp client session that hands out the responses
+    it was fed in order, keeping track of the requests made to it.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        """Records the request and returns the next response"""
+        self.requests.append({"url": url, "headers": headers or {}})
+
+        return self.responses.pop(0)
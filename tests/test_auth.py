@@ -1,11 +1,13 @@
 """
 Tests functions contained in src/auth.py
 """
+import asyncio
 import os
 
 import pytest
 
 import auth
+from admin_cache import ADMIN_CACHE, AdminCache
 
 
 @pytest.mark.parametrize("mock_slack_bolt_async_app", ["auth"], indirect=True)
@@ -26,9 +28,25 @@ class TestAuth:
 
         assert result is True
 
+    @pytest.mark.asyncio
+    async def test_warm_up_admin_cache(self, mock_slack_bolt_async_app, monkeypatch):
+        """Every page of users.list is cached, so no user needs to be looked up"""
+
+        async def unexpected_lookup(user_id):
+            raise AssertionError(f"{user_id} should have been cached")
+
+        monkeypatch.setattr(auth, "lookup_is_admin", unexpected_lookup)
+
+        assert await auth.warm_up_admin_cache() == 2
+        assert await auth.is_admin("listed_admin") is True
+        assert await auth.is_admin("listed_user") is False
+
+        ADMIN_CACHE.clear()
+
     @pytest.mark.asyncio
     async def test_generation_of_expected_hash(self, mock_slack_bolt_async_app):
         os.environ["SIGNING_SECRET"] = "super_secret"
+        auth.get_request_verifier.cache_clear()
 
         result = await auth.generate_expected_hash("946702800", b"I am a test body")
 
@@ -36,3 +54,62 @@ class TestAuth:
             result.hexdigest()
             == "a02c228c8010f0725da1a2a2524fb0f1dced42c5d56ed1ea11cdb603cf72a434"
         )
+
+
+def test_request_verifier_can_be_reused():
+    """A verifier gives the same answer no matter how many requests it has checked."""
+    verifier = auth.SlackRequestVerifier("super_secret")
+    signature = "v0=a02c228c8010f0725da1a2a2524fb0f1dced42c5d56ed1ea11cdb603cf72a434"
+
+    assert verifier.is_valid("946702800", b"I am a test body", signature)
+    assert not verifier.is_valid("946702800", b"I am another body", signature)
+    assert verifier.is_valid("946702800", b"I am a test body", signature)
+
+
+@pytest.mark.asyncio
+async def test_admin_cache_coalesces_concurrent_lookups():
+    """Users are looked up once no matter how many checks for them arrive at once."""
+    cache = AdminCache()
+    lookups = []
+
+    async def slow_lookup(user_id):
+        lookups.append(user_id)
+        await asyncio.sleep(0.01)
+        return user_id == "admin_user"
+
+    results = await asyncio.gather(
+        *(cache.get(user_id, slow_lookup) for user_id in ["admin_user"] * 3 + ["user"])
+    )
+
+    assert results == [True, True, True, False]
+    assert sorted(lookups) == ["admin_user", "user"]
+    assert await cache.get("admin_user", slow_lookup) is True
+    assert len(lookups) == 2
+    assert cache.stats()["coalesced"] == 2
+
+
+@pytest.mark.asyncio
+async def test_admin_cache_expires_and_invalidates_users():
+    """Users are looked up again once their entry expires or is invalidated."""
+    lookups = []
+
+    async def lookup(user_id):
+        lookups.append(user_id)
+        return True
+
+    expiring_cache = AdminCache(ttl=0)
+    await expiring_cache.get("admin_user", lookup)
+    await expiring_cache.get("admin_user", lookup)
+
+    assert len(lookups) == 2
+
+    cache = AdminCache(max_size=1)
+    cache.put("admin_user", False)
+    cache.invalidate("admin_user")
+
+    assert await cache.get("admin_user", lookup) is True
+
+    cache.put("other_user", False)
+
+    assert len(cache) == 1
+    assert cache.stats()["evictions"] == 1
@@ -2,13 +2,18 @@
 Tests the core Slack integration functionality of the application.
 """
 
+import asyncio
 import datetime
+import logging
 
 import pytest
 import pytz
 
+import bot
 import database
+from admin_cache import ADMIN_CACHE
 from bot import post_or_update_messages
+from message_builder import EventTimeline, chunk_messages, render_events
 
 week = datetime.datetime.strptime("10/22/2023", "%m/%d/%Y").replace(tzinfo=pytz.utc)
 
@@ -101,3 +106,261 @@ class TestBot:
 
         # Make sure the second message was recorded as if it were posted
         assert set(["message 1", "message 2"]) == {msg["message"] for msg in messages}
+
+    @pytest.mark.asyncio
+    async def test_post_or_update_messages_fans_out_to_every_channel(
+        self, db_cleanup, mock_slack_bolt_async_app
+    ):
+        """
+        post_or_update_messages posts every message to every subscribed channel,
+        keeping each channel's messages in order, and reports the results per channel.
+        """
+        fan_out_week = week + datetime.timedelta(weeks=2)
+        slack_ids = [f"fan_out_slack_id_{idx}" for idx in range(3)]
+
+        for slack_id in slack_ids:
+            await database.add_channel(slack_id)
+
+        summary = await post_or_update_messages(
+            fan_out_week,
+            [{"text": "message 1", "blocks": []}, {"text": "message 2", "blocks": []}],
+        )
+
+        for slack_id in slack_ids:
+            assert summary["results"][slack_id] == {
+                "posted": 2,
+                "updated": 0,
+                "unchanged": 0,
+            }
+            assert slack_id not in summary["errors"]
+
+        messages = await database.get_messages(fan_out_week)
+
+        for slack_id in slack_ids:
+            assert [
+                (msg["sequence_position"], msg["message"])
+                for msg in messages
+                if msg["slack_channel_id"] == slack_id
+            ] == [(0, "message 1"), (1, "message 2")]
+
+    @pytest.mark.asyncio
+    async def test_post_or_update_messages_isolates_channel_failures(
+        self, caplog, db_cleanup, mock_slack_bolt_async_app, monkeypatch
+    ):
+        """
+        A Slack error in one channel is recorded in the summary without
+        preventing the other channels from being updated.
+        """
+        failing_week = week + datetime.timedelta(weeks=3)
+
+        await database.add_channel("failing_slack_id")
+        await database.add_channel("healthy_slack_id")
+
+        original_post_message = bot.SLACK_APP.client.chat_postMessage
+
+        async def flaky_post_message(channel, **kwargs):
+            if channel == "failing_slack_id":
+                raise RuntimeError("Slack is having a bad day")
+
+            return await original_post_message(channel=channel, **kwargs)
+
+        monkeypatch.setattr(
+            bot.SLACK_APP.client, "chat_postMessage", flaky_post_message
+        )
+
+        summary = await post_or_update_messages(
+            failing_week, [{"text": "message 1", "blocks": []}]
+        )
+
+        assert isinstance(summary["errors"]["failing_slack_id"], RuntimeError)
+        assert summary["results"]["healthy_slack_id"]["posted"] == 1
+        assert "Slack is having a bad day" in caplog.text
+
+        messages = await database.get_messages(failing_week)
+
+        posted_channels = {msg["slack_channel_id"] for msg in messages}
+
+        assert "healthy_slack_id" in posted_channels
+        assert "failing_slack_id" not in posted_channels
+
+    @pytest.mark.asyncio
+    async def test_post_or_update_messages_records_each_channel_once_done(
+        self, db_cleanup, mock_slack_bolt_async_app, monkeypatch
+    ):
+        """
+        The messages posted to a channel are recorded as soon as that channel is done,
+        without waiting on the channels that are still being worked on.
+        """
+        recorded_week = week + datetime.timedelta(weeks=4)
+
+        await database.add_channel("quick_slack_id")
+        await database.add_channel("slow_slack_id")
+
+        original_post_message = bot.SLACK_APP.client.chat_postMessage
+        recorded_while_slow = []
+
+        async def slow_post_message(channel, **kwargs):
+            if channel == "slow_slack_id":
+                for _ in range(50):
+                    messages = await database.get_messages(recorded_week)
+
+                    if messages:
+                        recorded_while_slow.extend(
+                            msg["slack_channel_id"] for msg in messages
+                        )
+                        break
+
+                    await asyncio.sleep(0.01)
+
+            return await original_post_message(channel=channel, **kwargs)
+
+        monkeypatch.setattr(bot.SLACK_APP.client, "chat_postMessage", slow_post_message)
+
+        await post_or_update_messages(
+            recorded_week,
+            [{"text": "message 1", "blocks": []}],
+            slack_channel_ids=["quick_slack_id", "slow_slack_id"],
+        )
+
+        assert recorded_while_slow == ["quick_slack_id"]
+
+    @pytest.mark.asyncio
+    async def test_parse_events_for_weeks_skips_unchanged_weeks(
+        self,
+        db_cleanup,
+        mock_slack_bolt_async_app,
+        monkeypatch,
+        event_api_response_data,
+    ):
+        """
+        Once a week's events have been posted to every channel, parsing the same
+        events again skips the week without touching Slack.
+        """
+        slack_id = "digest_slack_id"
+        await database.add_channel(slack_id)
+
+        async def only_this_channel():
+            return [slack_id]
+
+        monkeypatch.setattr(database, "get_slack_channel_ids", only_this_channel)
+
+        slack_calls = []
+        original_post_message = bot.SLACK_APP.client.chat_postMessage
+
+        async def counting_post_message(**kwargs):
+            slack_calls.append(kwargs["channel"])
+            return await original_post_message(**kwargs)
+
+        monkeypatch.setattr(
+            bot.SLACK_APP.client, "chat_postMessage", counting_post_message
+        )
+
+        timeline = await EventTimeline.from_response(event_api_response_data)
+        weeks = [bot.get_week_start(week + datetime.timedelta(days=1))]
+        skipped_before = bot.WEEK_DIGEST_STATS["skipped"]
+
+        [first_summary] = await bot.parse_events_for_weeks(weeks, timeline)
+        posted_count = len(slack_calls)
+
+        [second_summary] = await bot.parse_events_for_weeks(weeks, timeline)
+
+        assert first_summary["results"][slack_id]["posted"] == posted_count > 0
+        assert second_summary == {"results": {}, "errors": {}}
+        assert len(slack_calls) == posted_count
+        assert bot.WEEK_DIGEST_STATS["skipped"] == skipped_before + 1
+
+    @pytest.mark.asyncio
+    async def test_parse_events_for_weeks_packs_new_channels_afresh(
+        self,
+        db_cleanup,
+        mock_slack_bolt_async_app,
+        monkeypatch,
+        event_api_response_data,
+    ):
+        """
+        Channels that already have messages keep their layout, while a channel that has
+        none yet gets the week packed into as few messages as possible.
+        """
+        channels = ["laid_out_slack_id", "new_slack_id"]
+
+        for slack_id in channels:
+            await database.add_channel(slack_id)
+
+        async def only_these_channels():
+            return channels
+
+        monkeypatch.setattr(database, "get_slack_channel_ids", only_these_channels)
+
+        timeline = await EventTimeline.from_response(event_api_response_data)
+        weeks = [bot.get_week_start(week + datetime.timedelta(days=1))]
+        event_blocks = [
+            rendered
+            async for rendered in render_events(timeline.by_week(weeks)[weeks[0]])
+        ]
+
+        # The week as it was posted before, split into one more message than it needs
+        packed = [
+            msg["event_uuids"] for msg in await chunk_messages(event_blocks, weeks[0])
+        ]
+        layout = [packed[0][:1], packed[0][1:], *packed[1:]]
+
+        async with database.MessageBatch() as batch:
+            for idx, event_uuids in enumerate(layout):
+                await batch.create_message(
+                    weeks[0],
+                    f"old message {idx}",
+                    f"{idx}.1",
+                    "laid_out_slack_id",
+                    idx,
+                    event_uuids,
+                )
+
+        [summary] = await bot.parse_events_for_weeks(weeks, timeline)
+
+        assert summary["results"]["laid_out_slack_id"]["updated"] == len(layout)
+        assert summary["results"]["new_slack_id"]["posted"] == len(packed)
+
+    @pytest.mark.asyncio
+    async def test_user_change_updates_cached_admin_status(
+        self, mock_slack_bolt_async_app
+    ):
+        """A user_change event replaces whatever admin status was cached for the user"""
+
+        async def unexpected_lookup(user_id):
+            raise AssertionError(f"{user_id} should have been cached")
+
+        ADMIN_CACHE.put("promoted_user", False)
+
+        await bot.handle_user_change(
+            event={"user": {"id": "promoted_user", "is_admin": True}},
+            logger=logging.getLogger(),
+        )
+
+        assert await ADMIN_CACHE.get("promoted_user", unexpected_lookup) is True
+
+        ADMIN_CACHE.invalidate("promoted_user")
+
+
+@pytest.mark.parametrize(
+    "today,weeks_ahead,expected_weeks",
+    [
+        # Early in the week only the current week is posted
+        ("10/23/2023", 0, ["10/22/2023"]),
+        ("10/24/2023", 0, ["10/22/2023"]),
+        # Five days before the next week starts it is posted as well
+        ("10/25/2023", 0, ["10/22/2023", "10/29/2023"]),
+        ("10/29/2023", 0, ["10/22/2023", "10/29/2023"]),
+        ("10/23/2023", 2, ["10/22/2023", "10/29/2023", "11/05/2023"]),
+        ("10/25/2023", 2, ["10/22/2023", "10/29/2023", "11/05/2023", "11/12/2023"]),
+    ],
+)
+def test_get_weeks_to_post(monkeypatch, today, weeks_ahead, expected_weeks):
+    """The posting horizon covers the current week and the configured weeks after it"""
+    monkeypatch.setattr(bot, "POST_WEEKS_AHEAD", weeks_ahead)
+
+    def parse(date):
+        return datetime.datetime.strptime(date, "%m/%d/%Y").replace(tzinfo=pytz.utc)
+
+    assert bot.get_weeks_to_post(parse(today)) == [
+        parse(expected) for expected in expected_weeks
+    ]
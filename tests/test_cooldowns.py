@@ -0,0 +1,37 @@
+"""
+Tests for the cooldowns.py file.
+"""
+
+import pytest
+
+from cooldowns import CooldownStore
+
+
+@pytest.mark.asyncio
+async def test_cooldown_store_tracks_cooldowns_in_memory(db_cleanup):
+    """A cooldown applies as soon as it's started, until it expires."""
+    store = CooldownStore()
+    await store.load()
+
+    assert not await store.is_on_cooldown("memory_domain", "check_api")
+
+    store.start_cooldown("memory_domain", "check_api", 15)
+    store.start_cooldown("expired_domain", "check_api", -20)
+
+    assert await store.is_on_cooldown("memory_domain", "check_api")
+    assert not await store.is_on_cooldown("memory_domain", "other_resource")
+    assert not await store.is_on_cooldown("expired_domain", "check_api")
+
+    store.flush()
+
+
+@pytest.mark.asyncio
+async def test_cooldown_store_survives_restarts(db_cleanup):
+    """Cooldowns are written to the database and loaded back after a restart."""
+    store = CooldownStore()
+    store.start_cooldown("durable_domain", "check_api", 15)
+    store.flush()
+
+    restarted_store = CooldownStore()
+
+    assert await restarted_store.is_on_cooldown("durable_domain", "check_api")
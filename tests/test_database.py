@@ -0,0 +1,303 @@
+"""
+Tests for the database.py file.
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+import database
+import retention
+
+
+def test_connection_pool_reuses_connections(tmp_path):
+    """Connections are handed back out after being released rather than reopened."""
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"), size=2)
+
+    conn = pool.acquire()
+    pool.release(conn)
+
+    assert pool.acquire() is conn
+
+    pool.close()
+
+
+def test_connection_pool_applies_pragmas(tmp_path):
+    """Pooled connections use the configured journal mode and pragmas."""
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"))
+
+    conn = pool.acquire()
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == (
+        database.DB_PRAGMAS["journal_mode"].lower()
+    )
+    assert (
+        conn.execute("PRAGMA cache_size").fetchone()[0]
+        == database.DB_PRAGMAS["cache_size"]
+    )
+
+    pool.release(conn)
+    pool.close()
+
+
+def test_connection_pool_checkpoints_on_close(tmp_path, monkeypatch):
+    """Closing the pool leaves every write in the database file itself."""
+    monkeypatch.setitem(database.DB_PRAGMAS, "journal_mode", "WAL")
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"))
+
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE things (name TEXT)")
+    conn.execute("INSERT INTO things VALUES ('thing')")
+    conn.commit()
+    pool.release(conn)
+
+    assert (tmp_path / "pool.db-wal").stat().st_size > 0
+
+    pool.close()
+
+    wal = tmp_path / "pool.db-wal"
+    assert not wal.exists() or wal.stat().st_size == 0
+
+    with sqlite3.connect(str(tmp_path / "pool.db")) as conn:
+        conn.execute("PRAGMA journal_mode = DELETE")
+        assert conn.execute("SELECT name FROM things").fetchall() == [("thing",)]
+
+
+def test_connection_pool_discards_closed_connections(tmp_path):
+    """Connections closed by whoever checked them out are not handed out again."""
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"))
+
+    conn = pool.acquire()
+    conn.close()
+    pool.release(conn)
+
+    assert pool.acquire() is not conn
+
+    pool.close()
+
+
+def test_connection_pool_rolls_back_uncommitted_work(tmp_path):
+    """Anything left uncommitted when a connection is released is rolled back."""
+    pool = database.ConnectionPool(str(tmp_path / "pool.db"))
+
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE things (name TEXT)")
+    conn.commit()
+    conn.execute("INSERT INTO things (name) VALUES ('forgotten')")
+    pool.release(conn)
+
+    conn = pool.acquire()
+
+    assert conn.execute("SELECT COUNT(*) FROM things").fetchone()[0] == 0
+
+    pool.release(conn)
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_queries_run_off_the_event_loop():
+    """Reads run on the reader threads and writes on the single writer thread."""
+
+    @database.run_in_executor()
+    def read_thread_name():
+        return threading.current_thread().name
+
+    @database.run_in_executor(write=True)
+    def write_thread_name():
+        return threading.current_thread().name
+
+    assert (await read_thread_name()).startswith("db_reader")
+    assert (await write_thread_name()).startswith("db_writer")
+
+
+@pytest.mark.asyncio
+async def test_message_batch_writes_creates_and_updates_together(db_cleanup):
+    """A message batch writes everything it collected once its block exits."""
+    await database.add_channel("batch_slack_id")
+    batch_week = "2023-11-26 00:00:00+00:00"
+
+    async with database.MessageBatch() as batch:
+        await batch.create_message(batch_week, "first", "1.1", "batch_slack_id", 0)
+        await batch.create_message(batch_week, "second", "1.2", "batch_slack_id", 1)
+
+        assert await database.get_messages(batch_week) == []
+
+    async with database.MessageBatch() as batch:
+        await batch.update_message(batch_week, "edited", "1.2", "batch_slack_id")
+
+    messages = await database.get_messages(batch_week)
+
+    assert [msg["message"] for msg in messages] == ["first", "edited"]
+
+
+@pytest.mark.asyncio
+async def test_message_batch_writes_when_interrupted(db_cleanup):
+    """Messages collected before an error are still written by the batch."""
+    await database.add_channel("interrupted_slack_id")
+    batch_week = "2023-12-03 00:00:00+00:00"
+
+    with pytest.raises(RuntimeError):
+        async with database.MessageBatch() as batch:
+            await batch.create_message(
+                batch_week, "posted", "2.1", "interrupted_slack_id", 0
+            )
+            raise RuntimeError("Slack went away")
+
+    messages = await database.get_messages(batch_week)
+
+    assert [msg["message"] for msg in messages] == ["posted"]
+
+
+@pytest.mark.asyncio
+async def test_message_batch_flushes_once_full(db_cleanup):
+    """A batch writes what it has collected as soon as it reaches its flush size."""
+    await database.add_channel("full_slack_id")
+    batch_week = "2023-12-10 00:00:00+00:00"
+
+    batch = database.MessageBatch(flush_size=2)
+    await batch.create_message(batch_week, "one", "3.1", "full_slack_id", 0)
+    await batch.create_message(batch_week, "two", "3.2", "full_slack_id", 1)
+
+    assert len(batch) == 0
+    assert len(await database.get_messages(batch_week)) == 2
+
+
+@pytest.mark.asyncio
+async def test_messages_record_their_events(db_cleanup):
+    """The uuids of the events in a message are stored alongside it."""
+    await database.add_channel("layout_slack_id")
+    layout_week = "2023-12-17 00:00:00+00:00"
+
+    async with database.MessageBatch() as batch:
+        await batch.create_message(
+            layout_week, "first", "4.1", "layout_slack_id", 0, ["a", "b"]
+        )
+        await batch.create_message(layout_week, "second", "4.2", "layout_slack_id", 1)
+
+    async with database.MessageBatch() as batch:
+        await batch.update_message(
+            layout_week, "second", "4.2", "layout_slack_id", ["c"]
+        )
+
+    messages = await database.get_messages(layout_week)
+
+    assert [msg["event_uuids"] for msg in messages] == [["a", "b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_get_channel_states(db_cleanup):
+    """Each channel's state is its latest week and how many messages it has."""
+    await database.add_channel("state_slack_id")
+    await database.add_channel("empty_slack_id")
+
+    async with database.MessageBatch() as batch:
+        await batch.create_message(
+            "2023-12-24 00:00:00+00:00", "old", "5.1", "state_slack_id", 0
+        )
+        await batch.create_message(
+            "2023-12-31 00:00:00+00:00", "one", "5.2", "state_slack_id", 0
+        )
+        await batch.create_message(
+            "2023-12-31 00:00:00+00:00", "two", "5.3", "state_slack_id", 1
+        )
+
+    channel_states = await database.get_channel_states()
+
+    assert channel_states["state_slack_id"] == {
+        "week": "2023-12-31 00:00:00+00:00",
+        "message_count": 2,
+    }
+    assert "empty_slack_id" not in channel_states
+
+
+@pytest.mark.asyncio
+async def test_get_several_weeks_at_once(db_cleanup):
+    """Messages and digests for several weeks are fetched together, keyed by week."""
+    await database.add_channel("weeks_slack_id")
+    first_week = "2024-01-07 00:00:00+00:00"
+    second_week = "2024-01-14 00:00:00+00:00"
+    empty_week = "2024-01-21 00:00:00+00:00"
+
+    async with database.MessageBatch() as batch:
+        await batch.create_message(second_week, "second", "6.2", "weeks_slack_id", 0)
+        await batch.create_message(first_week, "first", "6.1", "weeks_slack_id", 0)
+        await batch.set_week_digest(first_week, "weeks_slack_id", "digest")
+
+    messages = await database.get_weeks_messages([first_week, second_week, empty_week])
+    digests = await database.get_weeks_digests([first_week, empty_week])
+
+    assert {
+        week: [msg["message"] for msg in week_messages]
+        for week, week_messages in messages.items()
+    } == {first_week: ["first"], second_week: ["second"], empty_week: []}
+    assert digests == {first_week: {"weeks_slack_id": "digest"}, empty_week: {}}
+
+
+# Queries that are meant to read every row of a table
+FULL_TABLE_QUERIES = {"GET_SLACK_CHANNEL_IDS_SQL"}
+
+
+@pytest.mark.parametrize(
+    "module,query_name",
+    [
+        pytest.param(module, name, id=name)
+        for module in (database, retention)
+        for name in sorted(dir(module))
+        if name.endswith("_SQL") and name not in FULL_TABLE_QUERIES
+    ],
+)
+def test_queries_use_indexes(db_cleanup, module, query_name):
+    """Every query finds its rows through an index rather than scanning a table."""
+    query = getattr(module, query_name)
+
+    for conn in database.get_connection():
+        plan = conn.execute(
+            f"EXPLAIN QUERY PLAN {query}", [None] * query.count("?")
+        ).fetchall()
+
+    # Scanning the results of a subquery is fine since its rows have already been found,
+    # as is scanning the list of values passed in through json_each
+    subqueries = {
+        detail.split()[-1]
+        for *_, detail in plan
+        if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))
+    } | {"json_each"}
+
+    for *_, detail in plan:
+        if detail.startswith("SCAN ") and detail.split()[1] not in subqueries:
+            assert "USING" in detail, detail
+
+
+def test_migrate_upgrades_legacy_database(tmp_path):
+    """A database created before migrations were tracked is brought up to date."""
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    conn.executescript(
+        """
+        CREATE TABLE channels (
+            id integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+            slack_channel_id TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            week DATE NOT NULL,
+            message_timestamp TEXT NOT NULL,
+            message TEXT NOT NULL,
+            sequence_position INTEGER DEFAULT 0 NOT NULL,
+            channel_id INTEGER NOT NULL
+        );
+
+        INSERT INTO channels (slack_channel_id) VALUES ('legacy_slack_id');
+        INSERT INTO messages (week, message_timestamp, message, channel_id)
+            VALUES ('2023-10-22 00:00:00+00:00', '1698119853.135399', 'legacy', 1);
+        """
+    )
+
+    assert database.migrate(conn) == len(database.MIGRATIONS)
+    assert database.migrate(conn) == len(database.MIGRATIONS)
+    assert conn.execute(
+        "SELECT message, posted_at, event_uuids FROM messages"
+    ).fetchall() == [("legacy", 1698119853.135399, None)]
+
+    conn.close()
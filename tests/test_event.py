@@ -2,6 +2,10 @@
 Tests the parsing of events data
 """
 
+import dataclasses
+
+import pytest
+
 import event
 
 
@@ -41,3 +45,22 @@ def test_parsing_location_of_event_missing_state_and_latitude(sample_event_date)
     result = event.parse_location(event_data_without_state_and_lat)
 
     assert result == "Gower Estates Park"
+
+
+def test_events_are_immutable(sample_event_date):
+    """Events can't be changed once created, and don't carry a __dict__ around"""
+    sample_event = event.Event.from_event_json(sample_event_date)
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        sample_event.title = "Something else"
+
+    assert not hasattr(sample_event, "__dict__")
+
+
+def test_event_rendering_is_memoized(sample_event_date):
+    """An event's blocks and text are only rendered the first time they're asked for"""
+    sample_event = event.Event.from_event_json(sample_event_date)
+
+    assert sample_event.generate_blocks() is sample_event.generate_blocks()
+    assert sample_event.generate_text() is sample_event.generate_text()
+    assert "Tankin' Around Greenville" in sample_event.generate_text()
@@ -0,0 +1,117 @@
+"""
+Tests for the events_api.py file.
+"""
+
+import mocks
+import pytest
+
+from events_api import FeedCache, FeedResponse, fetch_events, iter_json_array
+
+URL = "https://events.example.com/api/gtc"
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_caches_the_feed(tmp_path):
+    """The first fetch downloads the feed and remembers its validators."""
+    cache = FeedCache(str(tmp_path))
+    session = mocks.MockSession(
+        mocks.MockResponse(
+            body=b'[{"uuid": "1"}]',
+            headers={"ETag": '"v1"', "Last-Modified": "Tue, 24 Oct 2023 01:40:12 GMT"},
+        )
+    )
+
+    feed = await fetch_events(session, URL, cache)
+
+    assert await feed.json() == [{"uuid": "1"}]
+    assert not feed.not_modified
+    assert session.requests[0]["headers"] == {}
+    assert cache.get_validators(URL) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Tue, 24 Oct 2023 01:40:12 GMT",
+    }
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_uses_cache_when_not_modified(tmp_path):
+    """Whenever the API says the feed hasn't changed the cached copy is used."""
+    cache = FeedCache(str(tmp_path))
+    session = mocks.MockSession(
+        mocks.MockResponse(body=b'[{"uuid": "1"}]', headers={"ETag": '"v1"'}),
+        mocks.MockResponse(status=304, body=b""),
+    )
+
+    first_feed = await fetch_events(session, URL, cache)
+    second_feed = await fetch_events(session, URL, cache)
+
+    assert session.requests[1]["headers"] == {"If-None-Match": '"v1"'}
+    assert second_feed.not_modified
+    assert second_feed.digest == first_feed.digest
+    assert await second_feed.json() == [{"uuid": "1"}]
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_refetches_if_cached_copy_is_missing(tmp_path):
+    """If the cached copy disappears the feed is downloaded again in full."""
+    cache = FeedCache(str(tmp_path))
+    session = mocks.MockSession(
+        mocks.MockResponse(body=b"[]", headers={"ETag": '"v1"'}),
+        mocks.MockResponse(status=304, body=b""),
+        mocks.MockResponse(body=b'[{"uuid": "2"}]', headers={"ETag": '"v2"'}),
+    )
+
+    await fetch_events(session, URL, cache)
+
+    # Pretend the body was removed after the validators were read
+    real_read = cache.read
+
+    def vanished_read(url):
+        del url
+        cache.read = real_read
+        raise FileNotFoundError(cache.body_path)
+
+    cache.read = vanished_read
+
+    feed = await fetch_events(session, URL, cache)
+
+    assert session.requests[2]["headers"] == {}
+    assert await feed.json() == [{"uuid": "2"}]
+
+
+async def _chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+async def test_iter_json_array_decodes_items_split_across_chunks(chunk_size):
+    """Items are decoded one at a time no matter where the chunks are split."""
+    body = '[ {"uuid": "1", "name": "Caf\u00e9 ☕"}, 12345,\n"two" ]'.encode("utf-8")
+
+    items = [item async for item in iter_json_array(_chunked(body, chunk_size))]
+
+    assert items == [{"uuid": "1", "name": "Café ☕"}, 12345, "two"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [b'{"uuid": "1"}', b'[{"uuid": "1"}', b'[{"uuid": '])
+async def test_iter_json_array_rejects_malformed_feeds(body):
+    """Anything other than a complete JSON array is an error."""
+    with pytest.raises(ValueError):
+        async for _ in iter_json_array(_chunked(body, 4)):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_streams_the_feed_to_disk(tmp_path):
+    """A downloaded feed is read back from the cached copy rather than from memory."""
+    cache = FeedCache(str(tmp_path))
+    body = b'[{"uuid": "1"}, {"uuid": "2"}]'
+    session = mocks.MockSession(mocks.MockResponse(body=body))
+
+    feed = await fetch_events(session, URL, cache)
+
+    assert feed.body is None
+    assert feed.digest == FeedResponse.from_body(body).digest
+    assert [event["uuid"] async for event in feed.events()] == ["1", "2"]
@@ -0,0 +1,72 @@
+"""
+Tests for the http_client.py file.
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from http_client import HttpClient, SharedSessionWebClient
+
+
+@pytest.mark.asyncio
+async def test_session_is_shared_within_a_loop():
+    """Every request made on a loop goes through the same session until it's closed."""
+    http_client = HttpClient()
+
+    session = http_client.session()
+
+    assert http_client.session() is session
+    assert SharedSessionWebClient(http_client=http_client).session is session
+
+    await http_client.close()
+
+    assert session.closed
+    assert http_client.session() is not session
+
+    await http_client.close()
+
+
+def test_each_loop_gets_its_own_session():
+    """Sessions can't be shared between event loops, so each loop gets its own."""
+    http_client = HttpClient()
+
+    async def use_session():
+        session = http_client.session()
+        await http_client.close()
+        return session
+
+    assert asyncio.run(use_session()) is not asyncio.run(use_session())
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused():
+    """Requests to the same host reuse the pooled connection rather than opening more."""
+
+    async def hello(_request):
+        return web.Response(text="hello")
+
+    app = web.Application()
+    app.router.add_get("/", hello)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+
+    http_client = HttpClient()
+
+    try:
+        for _ in range(3):
+            async with http_client.session().get(f"http://127.0.0.1:{port}/") as resp:
+                assert await resp.text() == "hello"
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+    assert http_client.stats() == {
+        "requests": 3,
+        "new_connections": 1,
+        "reused_connections": 2,
+    }
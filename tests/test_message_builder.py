@@ -8,10 +8,13 @@ import pytest
 import pytz
 
 from message_builder import (
+    MAX_MESSAGE_BLOCKS,
     MAX_MESSAGE_CHARACTER_LENGTH,
+    EventTimeline,
     build_event_blocks,
     build_header,
     build_single_event_block,
+    build_timeline_event_blocks,
     chunk_messages,
     total_messages_needed,
 )
@@ -35,6 +38,72 @@ async def test_build_event_blocks_date_range(event_api_response_data):
     assert len(event_blocks) == 9
 
 
+@pytest.mark.asyncio
+async def test_event_timeline_slices_events_by_time(event_api_response_data):
+    """
+    Tests that the timeline hands back exactly the events within a window, in order.
+    """
+    timeline = await EventTimeline.from_response(event_api_response_data)
+
+    events = timeline.between(week_start, week_end)
+
+    assert [event.time for event in events] == sorted(
+        event.time for event in timeline.events if week_start <= event.time <= week_end
+    )
+    assert timeline.between(week_end, week_start) == []
+
+
+@pytest.mark.asyncio
+async def test_event_timeline_only_keeps_events_in_its_window(event_api_response_data):
+    """
+    Tests that a timeline built for a window holds nothing but the events within it.
+    """
+    full_timeline = await EventTimeline.from_response(event_api_response_data)
+    timeline = await EventTimeline.from_response(
+        event_api_response_data, week_start, week_end
+    )
+
+    assert timeline.events == full_timeline.between(week_start, week_end)
+    assert len(timeline.events) < len(full_timeline.events)
+
+
+@pytest.mark.asyncio
+async def test_event_timeline_buckets_events_by_week(event_api_response_data):
+    """
+    Tests that bucketing events into several weeks at once matches slicing each week out.
+    """
+    timeline = await EventTimeline.from_response(event_api_response_data)
+    weeks = [week_start + datetime.timedelta(weeks=idx) for idx in range(-1, 3)]
+
+    buckets = timeline.by_week(weeks)
+
+    assert list(buckets) == weeks
+    for week in weeks:
+        assert buckets[week] == timeline.between(
+            week, week + datetime.timedelta(days=7)
+        )
+    assert sum(map(len, buckets.values())) > 0
+
+
+@pytest.mark.asyncio
+async def test_build_timeline_event_blocks_reuses_one_timeline(event_api_response_data):
+    """
+    Tests that one decoded timeline can be used to build the blocks for several weeks.
+    """
+    timeline = await EventTimeline.from_response(event_api_response_data)
+    next_week_start = week_end
+    next_week_end = week_end + datetime.timedelta(days=7)
+
+    assert len(await build_timeline_event_blocks(timeline, week_start, week_end)) == 9
+    assert len(
+        await build_timeline_event_blocks(timeline, next_week_start, next_week_end)
+    ) == len(
+        await build_event_blocks(
+            event_api_response_data, next_week_start, next_week_end
+        )
+    )
+
+
 @pytest.mark.asyncio
 async def test_build_single_event_block_date_range(single_event_data):
     """
@@ -98,6 +167,103 @@ async def test_chunk_messages(event_api_response_data):
     )
 
 
+@pytest.mark.asyncio
+async def test_chunk_messages_respects_block_limit():
+    """
+    Makes sure that short events are split across messages once they would exceed
+    Slack's block limit, and that every header counts the messages correctly.
+    """
+    event_blocks = [
+        {
+            "blocks": [{"type": "header"}, {"type": "section"}, {"type": "divider"}],
+            "text": "Short event\n\n",
+            "text_length": 13,
+        }
+        for _ in range(20)
+    ]
+
+    result = await chunk_messages(event_blocks, week_start)
+
+    assert len(result) == 2
+    assert all(len(msg["blocks"]) <= MAX_MESSAGE_BLOCKS for msg in result)
+    assert sum(msg["text"].count("Short event") for msg in result) == 20
+    assert "1 of 2" in result[0]["text"]
+    assert "2 of 2" in result[1]["text"]
+
+
+@pytest.mark.asyncio
+async def test_chunk_messages_keeps_previous_layout(event_api_response_data):
+    """
+    Makes sure that removing an event only changes the message it was in when the
+    previous layout is given, rather than shifting every later event forwards.
+    """
+    event_blocks = await build_event_blocks(
+        event_api_response_data, week_start, week_end
+    )
+    previous = await chunk_messages(event_blocks, week_start)
+    layout = [msg["event_uuids"] for msg in previous]
+
+    result = await chunk_messages(event_blocks[1:], week_start, layout)
+
+    assert len(result) == len(previous) == 2
+    assert result[0]["text"] != previous[0]["text"]
+    assert result[1]["text"] == previous[1]["text"]
+    assert (await chunk_messages(event_blocks[1:], week_start))[1]["text"] != (
+        previous[1]["text"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_chunk_messages_absorbs_an_added_event_in_its_message():
+    """
+    Makes sure that an event added to a message that was packed as full as it would be
+    packed afresh only changes that message, rather than pushing an event into each
+    of the messages after it.
+    """
+
+    def short_event(name):
+        return {
+            "uuid": name,
+            "blocks": [{"type": "header"}, {"type": "section"}, {"type": "divider"}],
+            "text": f"{name}\n\n",
+            "text_length": len(name) + 2,
+        }
+
+    event_blocks = [short_event(f"Event {idx}") for idx in range(40)]
+    previous = await chunk_messages(event_blocks, week_start)
+    layout = [msg["event_uuids"] for msg in previous]
+    added = event_blocks[:1] + [short_event("Added event")] + event_blocks[1:]
+
+    def changed_messages(result):
+        return sum(
+            msg["text"] != previous_msg["text"]
+            for msg, previous_msg in zip(result, previous)
+        )
+
+    assert len(previous) == 4
+    assert changed_messages(await chunk_messages(added, week_start, layout)) == 1
+    assert changed_messages(await chunk_messages(added, week_start)) == 4
+
+
+@pytest.mark.asyncio
+async def test_chunk_messages_never_leaves_a_message_empty(event_api_response_data):
+    """
+    Makes sure that a message whose events have all gone is dropped by packing the
+    week afresh, rather than being kept in the layout as nothing but a header.
+    """
+    event_blocks = await build_event_blocks(
+        event_api_response_data, week_start, week_end
+    )
+    previous = await chunk_messages(event_blocks, week_start)
+    layout = [msg["event_uuids"] for msg in previous]
+    remaining = event_blocks[: len(layout[0])]
+
+    result = await chunk_messages(remaining, week_start, layout)
+
+    assert len(result) == 1
+    assert result[0]["event_uuids"] == layout[0]
+
+
 @pytest.mark.asyncio
 async def test_total_messages_needed_with_borderline_edge_case():
     """
@@ -0,0 +1,72 @@
+"""
+Tests for the rate_limiter.py file.
+"""
+
+import pytest
+from slack_sdk.errors import SlackApiError
+
+from rate_limiter import SlackRateLimiter, TokenBucket
+
+
+class ThrottledResponse:  # pylint: disable=too-few-public-methods
+    """A pared-down Slack response for a request that was rate limited."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: str):
+        self.headers = {"Retry-After": retry_after}
+
+
+def test_token_bucket_makes_callers_wait_once_empty():
+    """Callers have to wait for a token once the bucket's capacity is used up."""
+    bucket = TokenBucket(rate=1, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 1
+
+
+def test_token_bucket_pause_holds_back_tokens():
+    """Pausing a bucket keeps any tokens from being handed out until the pause ends."""
+    bucket = TokenBucket(rate=10, capacity=10)
+
+    bucket.pause(5)
+
+    assert bucket.reserve() >= 5
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_retries_throttled_calls():
+    """Calls which Slack throttles are retried once the Retry-After period has passed."""
+    limiter = SlackRateLimiter(max_retries=2)
+    attempts = []
+
+    async def users_info(user):
+        attempts.append(user)
+
+        if len(attempts) == 1:
+            raise SlackApiError("ratelimited", ThrottledResponse("0"))
+
+        return {"ok": True}
+
+    result = await limiter.call("users.info", users_info, user="some_user")
+
+    assert result == {"ok": True}
+    assert attempts == ["some_user", "some_user"]
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.stats()["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_gives_up_after_max_retries():
+    """Once a call has been throttled too many times the error is raised to the caller."""
+    limiter = SlackRateLimiter(max_retries=1)
+
+    async def users_info(user):
+        del user
+        raise SlackApiError("ratelimited", ThrottledResponse("0"))
+
+    with pytest.raises(SlackApiError):
+        await limiter.call("users.info", users_info, user="some_user")
+
+    assert limiter.stats()["throttled"] == 1
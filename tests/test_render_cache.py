@@ -0,0 +1,54 @@
+"""
+Tests for the render_cache.py file.
+"""
+
+import pytest
+
+from event import Event
+from message_builder import render_event_block
+from render_cache import RENDER_CACHE, RenderCache
+
+
+def test_render_cache_evicts_least_recently_used():
+    """Once full, the cache evicts whichever event was used least recently."""
+    cache = RenderCache(max_size=2)
+
+    cache.put(("a",), {"text": "a"})
+    cache.put(("b",), {"text": "b"})
+    cache.get(("a",))
+    cache.put(("c",), {"text": "c"})
+
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == {"text": "a"}
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1, "evictions": 1}
+
+
+@pytest.mark.asyncio
+async def test_render_cache_persists_to_database(db_cleanup):
+    """A persisted cache can be loaded back from the database after a restart."""
+    key = ("persisted_uuid", "some_hash", "US/Eastern", 1)
+    evicted_key = ("evicted_uuid", "some_hash", "US/Eastern", 1)
+
+    cache = RenderCache(max_size=1, persist=True)
+    cache.put(evicted_key, {"text": "evicted"})
+    await cache.save()
+    cache.put(key, {"text": "persisted"})
+    await cache.save()
+
+    restarted_cache = RenderCache(max_size=10, persist=True)
+    await restarted_cache.load()
+
+    assert restarted_cache.get(key) == {"text": "persisted"}
+    assert restarted_cache.get(evicted_key) is None
+
+
+@pytest.mark.asyncio
+async def test_render_event_block_reuses_cached_rendering(sample_event_date):
+    """Rendering the same event twice is served from the cache the second time."""
+    hits_before = RENDER_CACHE.stats()["hits"]
+
+    first = await render_event_block(Event.from_event_json(sample_event_date))
+    second = await render_event_block(Event.from_event_json(sample_event_date))
+
+    assert first is second
+    assert RENDER_CACHE.stats()["hits"] == hits_before + 1
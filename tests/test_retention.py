@@ -0,0 +1,33 @@
+"""
+Tests for the retention.py file.
+"""
+
+import pytest
+
+import database
+import retention
+
+
+@pytest.mark.asyncio
+async def test_delete_old_messages_in_batches(db_cleanup):
+    """Old rows are deleted a batch at a time, leaving recent ones alone."""
+    await database.add_channel("retention_slack_id")
+    retention_week = "2023-01-01 00:00:00+00:00"
+
+    async with database.MessageBatch() as batch:
+        for idx in range(5):
+            await batch.create_message(
+                retention_week, "old", f"1000000{idx}.1", "retention_slack_id", idx
+            )
+        await batch.create_message(
+            retention_week, "new", "99999999999.1", "retention_slack_id", 5
+        )
+
+    stats = await retention.delete_old_messages(batch_size=2, pause=0)
+
+    assert stats["messages"]["deleted"] >= 5
+    assert stats["messages"]["batches"] >= 3
+    assert stats["messages"]["max_lock_seconds"] <= stats["messages"]["lock_seconds"]
+    assert [msg["message"] for msg in await database.get_messages(retention_week)] == [
+        "new"
+    ]
@@ -0,0 +1,140 @@
+"""
+Tests for the scheduler.py file.
+"""
+
+import asyncio
+import datetime
+
+import pytest
+
+import scheduler
+from scheduler import Cron, Interval, Scheduler, parse_schedule
+
+now = datetime.datetime(2023, 10, 22, 12, 30, 15)
+
+
+def test_interval_keeps_its_cadence():
+    """Intervals run right away, then on a fixed cadence, skipping any missed runs."""
+    interval = Interval(60)
+
+    assert interval.next_run(None, now) == now
+    assert interval.next_run(now, now) == now + datetime.timedelta(seconds=60)
+    assert interval.next_run(now, now + datetime.timedelta(seconds=150)) == (
+        now + datetime.timedelta(seconds=180)
+    )
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        ("* * * * *", datetime.datetime(2023, 10, 22, 12, 31)),
+        ("0 * * * *", datetime.datetime(2023, 10, 22, 13, 0)),
+        ("*/15 9-17 * * *", datetime.datetime(2023, 10, 22, 12, 45)),
+        ("0 3 * * *", datetime.datetime(2023, 10, 23, 3, 0)),
+        # October 22nd, 2023 is a Sunday
+        ("0 9 * * 1-5", datetime.datetime(2023, 10, 23, 9, 0)),
+        ("0 9 * * 7", datetime.datetime(2023, 10, 29, 9, 0)),
+        ("0 0 1 1 *", datetime.datetime(2024, 1, 1, 0, 0)),
+        # Either day field matching is enough when both are restricted
+        ("0 0 1 * 3", datetime.datetime(2023, 10, 25, 0, 0)),
+    ],
+)
+def test_cron_finds_the_next_matching_minute(expression, expected):
+    """Cron expressions run on the next minute that matches every field."""
+    assert Cron(expression).next_run(None, now) == expected
+
+
+def test_cron_keeps_to_local_time_across_daylight_saving_time():
+    """Cron expressions match the local time on the day they run, not the day before."""
+    # Daylight saving time ends in the US/Eastern time zone on November 1st, 2026
+    before_change = datetime.datetime(2026, 10, 31, 12, 0).astimezone()
+
+    next_run = Cron("0 9 * * *").next_run(None, before_change)
+
+    assert next_run.replace(tzinfo=None) == datetime.datetime(2026, 11, 1, 9, 0)
+    assert next_run.utcoffset() == datetime.timedelta(hours=-5)
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "0 0 31 2 *"])
+def test_cron_rejects_bad_expressions(expression):
+    """Cron expressions that are malformed or can never match are errors."""
+    with pytest.raises(ValueError):
+        Cron(expression).next_run(None, now)
+
+
+def test_parse_schedule():
+    """Schedules are either a number of seconds or a cron expression."""
+    assert isinstance(parse_schedule("3600"), Interval)
+    assert isinstance(parse_schedule("0 * * * *"), Cron)
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_on_their_schedule_until_stopped():
+    """Jobs run repeatedly on their schedule, and never overlap with themselves."""
+    runs = []
+    running = []
+
+    async def job():
+        running.append(None)
+        runs.append(len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+
+    jobs = Scheduler()
+    jobs.add_job("repeating", job, schedule=Interval(0.01))
+    jobs.add_job("once", job)
+
+    stopped = []
+
+    async def on_stop():
+        stopped.append(None)
+
+    jobs.on_stop(on_stop)
+
+    await jobs.start()
+    await asyncio.sleep(0.15)
+    await jobs.stop()
+
+    assert stopped == [None]
+
+    states = jobs.describe()
+
+    assert states["repeating"]["runs"] >= 3
+    assert states["repeating"]["skipped_runs"] >= 1
+    assert states["repeating"]["state"] == "stopped"
+    assert states["once"]["runs"] == 1
+    assert states["once"]["state"] == "done"
+    assert jobs.failed_jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_failing_jobs_follow_their_restart_policy(monkeypatch):
+    """Failures are retried or not according to the job's policy, and get reported."""
+    monkeypatch.setattr(scheduler, "BACKOFF_BASE_SECONDS", 0.01)
+
+    async def failing_job():
+        raise RuntimeError("The API is down")
+
+    async def slow_job():
+        await asyncio.sleep(1)
+
+    jobs = Scheduler()
+    jobs.add_job("retried", failing_job, schedule=Interval(3600), max_failures=2)
+    jobs.add_job("given_up", failing_job, schedule=Interval(0.01), restart="never")
+    jobs.add_job(
+        "timed_out", slow_job, schedule=Interval(3600), timeout=0.01, restart="always"
+    )
+
+    await jobs.start()
+    await asyncio.sleep(0.1)
+    await jobs.stop()
+
+    states = jobs.describe()
+
+    assert states["retried"]["failures"] >= 2
+    assert states["retried"]["last_error"] == "RuntimeError('The API is down')"
+    assert states["given_up"]["runs"] == 1
+    assert states["given_up"]["state"] == "failed"
+    assert states["timed_out"]["failures"] == 1
+    assert states["timed_out"]["last_error"] == "TimeoutError()"
+    assert sorted(jobs.failed_jobs()) == ["given_up", "retried"]
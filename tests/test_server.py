@@ -10,7 +10,11 @@ import time
 import helpers
 import pytest
 
+import auth
 import database
+from cooldowns import COOLDOWNS
+from scheduler import SCHEDULER
+from server import read_slash_command_fields
 
 
 def test_health_check_healthy_threads(test_client):
@@ -35,6 +39,26 @@ def test_health_check_with_a_dead_thread(
     }
 
 
+def test_health_check_with_a_failed_job(test_client, monkeypatch):
+    """Tests what happens if a periodic job has stopped or keeps failing."""
+    monkeypatch.setattr(SCHEDULER, "failed_jobs", lambda: ["check_api"])
+
+    response = test_client.get("healthz")
+
+    assert response.status_code == 500
+    assert response.json() == {
+        "detail": "The check_api job has failed. This container will soon restart."
+    }
+
+
+def test_list_jobs(test_client):
+    """Every periodic job is listed along with its state."""
+    response = test_client.get("jobs")
+
+    assert response.status_code == 200
+    assert {"check_api", "delete_old_messages"} <= set(response.json())
+
+
 TEAM_DOMAIN = "team_awesome"
 
 RATE_LIMIT_COPY = (
@@ -77,6 +101,8 @@ async def test_check_api_whenever_someone_executes_it_after_expiry(
     """
     # Create a cooldown that has expired 20 minutes ago.
     await database.create_cooldown(TEAM_DOMAIN, "check_api", -20)
+    # Load the cooldown from the database as though the bot had just started
+    COOLDOWNS.clear()
 
     response = test_client.post(
         "/slack/events",
@@ -103,6 +129,8 @@ async def test_check_api_whenever_someone_executes_it_before_expiry(
     then they should receive a message telling them to try again later.
     """
     await database.create_cooldown(TEAM_DOMAIN, "check_api", 15)
+    # Load the cooldown from the database as though the bot had just started
+    COOLDOWNS.clear()
 
     response = test_client.post(
         "/slack/events",
@@ -114,6 +142,27 @@ async def test_check_api_whenever_someone_executes_it_before_expiry(
     assert response.content.decode("utf-8") == RATE_LIMIT_COPY
 
 
+@pytest.mark.parametrize(
+    "payload,expected_fields",
+    [
+        (
+            helpers.create_slack_request_payload(
+                command="/check_api", team_domain=TEAM_DOMAIN
+            ),
+            {"command": "/check_api", "team_domain": TEAM_DOMAIN},
+        ),
+        (
+            b"command=%2Fcheck_api&team_domain=last_field",
+            {"command": "/check_api", "team_domain": "last_field"},
+        ),
+        (b"text=command%3D%2Fcheck_api", {}),
+    ],
+)
+def test_read_slash_command_fields(payload, expected_fields):
+    """Only the command and team_domain fields themselves are pulled from the body."""
+    assert read_slash_command_fields(payload) == expected_fields
+
+
 def test_possible_replay_attack_mitigation(test_client, caplog):
     """
     If the timestamp provided in the headers is beyond 5 minutes of the
@@ -158,6 +207,7 @@ def test_valid_slack_signature_allows_request_to_be_processed(test_client, caplo
     """
     test_signing_secret = "super_secret"
     os.environ["SIGNING_SECRET"] = test_signing_secret
+    auth.get_request_verifier.cache_clear()
     timestamp = str(int(time.time()))
     body = helpers.create_slack_request_payload(
         command="/add_channel", team_domain=TEAM_DOMAIN
@@ -190,6 +240,7 @@ def test_invalid_slack_signature_raises_error(test_client, caplog):
     in the request headers then the bot will raise an exception.
     """
     os.environ["SIGNING_SECRET"] = "super_secret"
+    auth.get_request_verifier.cache_clear()
 
     test_client.post(
         "/slack/events",
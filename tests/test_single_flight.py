@@ -0,0 +1,139 @@
+"""
+Tests for the single_flight.py file.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class SlowJob:  # pylint: disable=too-few-public-methods
+    """A job that takes a moment to run and remembers how it was run"""
+
+    def __init__(self):
+        self.runs = []
+        self.running = 0
+        self.most_running = 0
+
+    async def __call__(self, force: bool = False):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        self.runs.append(force)
+
+        await asyncio.sleep(0.05)
+
+        self.running -= 1
+
+        return len(self.runs)
+
+
+@pytest.mark.asyncio
+async def test_a_burst_of_requests_runs_at_most_twice():
+    """Requests made during a run share a single follow-up run."""
+    job = SlowJob()
+    runs = SingleFlight(job)
+
+    first = asyncio.ensure_future(runs.run())
+    await asyncio.sleep(0.01)
+    burst = await asyncio.gather(*(runs.run(force=idx == 2) for idx in range(5)))
+
+    assert await first == 1
+    assert burst == [2] * 5
+    assert job.runs == [False, True]
+    assert job.most_running == 1
+    assert runs.stats() == {"runs": 2, "queued": 1, "attached": 4}
+
+
+@pytest.mark.asyncio
+async def test_failures_reach_everyone_waiting_on_the_run():
+    """A failed run raises for all of its waiters without blocking later runs."""
+    calls = []
+
+    async def flaky_job(force: bool = False):
+        del force
+        calls.append(None)
+        await asyncio.sleep(0.01)
+
+        if len(calls) == 1:
+            raise RuntimeError("The API is down")
+
+        return "ok"
+
+    runs = SingleFlight(flaky_job)
+
+    results = await asyncio.gather(runs.run(), runs.run(), return_exceptions=True)
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == "ok"
+    assert await runs.run() == "ok"
+
+
+@pytest.mark.asyncio
+async def test_requests_from_other_threads_join_the_run():
+    """Requests from another thread's event loop wait on the run in progress."""
+    job = SlowJob()
+    runs = SingleFlight(job)
+
+    first = asyncio.ensure_future(runs.run())
+    await asyncio.sleep(0.01)
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(asyncio.run(runs.run())), name="other_loop"
+    )
+    thread.start()
+
+    assert await first == 1
+    await asyncio.to_thread(thread.join)
+
+    assert results == [2]
+    assert job.most_running == 1
+
+
+@pytest.mark.asyncio
+async def test_runs_that_take_too_long_are_cancelled():
+    """A run that outlasts the timeout is cancelled rather than left blocking later runs."""
+    cancelled = []
+
+    async def stuck_job(force: bool = False):
+        del force
+
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(None)
+            raise
+
+    runs = SingleFlight(stuck_job, timeout=0.01)
+
+    with pytest.raises(TimeoutError):
+        await runs.run()
+
+    assert cancelled == [None]
+
+    async def quick_job(force: bool = False):
+        del force
+        return "ok"
+
+    runs.job = quick_job
+    assert await runs.run() == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cancelling_abandons_the_run_and_its_follow_up():
+    """Cancelling stops the run in progress, and everyone waiting is told so."""
+    job = SlowJob()
+    runs = SingleFlight(job)
+
+    waiters = [asyncio.ensure_future(runs.run()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    await runs.cancel()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert job.runs == [False]
+    assert await runs.run() == 2